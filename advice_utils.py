@@ -0,0 +1,88 @@
+# advice_utils.py
+import hashlib
+import json
+
+import pandas as pd
+
+import database_utils
+
+# --- RESUMO ESTATÍSTICO PARA AS DICAS DO CONSULTOR ---
+# O prompt de dicas recebe um resumo de tamanho fixo, e não a lista de despesas: totais por
+# categoria contra o orçamento, variação em relação ao mês anterior e à média dos meses
+# anteriores (lidos do resumo mensal) e os maiores estabelecimentos (agregados no banco).
+# O tamanho depende só do número de categorias e de TOP_MERCHANTS, nunca do número de despesas.
+
+TREND_MONTHS = 3
+TOP_MERCHANTS = 5
+
+
+def build_digest(username, year_month, budgets, trend_months=TREND_MONTHS, top_merchants=TOP_MERCHANTS):
+    """
+    Monta o resumo do mês 'AAAA-MM' como dict serializável. budgets é {categoria: limite}.
+    As contas são feitas em centavos e os valores saem em reais, para que o mesmo dado gere
+    sempre o mesmo resumo.
+    """
+    month = pd.Period(year_month, freq='M')
+    first_month = (month - trend_months).strftime('%Y-%m')
+    totals = database_utils.get_monthly_category_totals(username, first_month, year_month)
+    by_month = totals.pivot_table(index='Categoria', columns='Mês', values='Centavos', aggfunc='sum', fill_value=0)
+    previous_months = [(month - i).strftime('%Y-%m') for i in range(1, trend_months + 1)]
+    reais = database_utils.to_reais
+
+    def spent(category, month_str):
+        if category in by_month.index and month_str in by_month.columns:
+            return int(by_month.at[category, month_str])
+        return 0
+
+    categories = []
+    total = budget_total = 0
+    for category in sorted(set(budgets) | set(by_month.index)):
+        current = spent(category, year_month)
+        history = [spent(category, m) for m in previous_months]
+        budget = database_utils.to_cents(budgets.get(category) or 0)
+        if not current and not budget and not any(history):
+            continue
+        total += current
+        budget_total += budget
+        categories.append({
+            'categoria': category,
+            'gasto': reais(current),
+            'orcamento': reais(budget),
+            'variacao_mes_anterior': reais(current - history[0]),
+            'media_meses_anteriores': reais(round(sum(history) / len(history))),
+        })
+    categories.sort(key=lambda c: (-c['gasto'], c['categoria']))
+
+    merchants = database_utils.get_top_merchants(username, year_month, top_merchants)
+    return {
+        'mes': year_month,
+        'total': reais(total),
+        'orcamento_total': reais(budget_total),
+        'categorias': categories,
+        'estabelecimentos': [{'nome': n, 'total': reais(t), 'quantidade': q} for n, t, q in merchants],
+    }
+
+
+def digest_version(digest):
+    """Hash do resumo: muda sempre que algum dado do mês (ou da tendência) muda."""
+    payload = json.dumps(digest, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def format_digest(digest):
+    """Texto compacto do resumo para o prompt."""
+    lines = [
+        f"Mês: {digest['mes']}",
+        f"Total gasto: R$ {digest['total']:.2f} (orçamento total: R$ {digest['orcamento_total']:.2f})",
+        "Categorias (gasto | orçamento | variação vs. mês anterior | média dos meses anteriores):",
+    ]
+    for c in digest['categorias']:
+        budget = f"R$ {c['orcamento']:.2f}" if c['orcamento'] else "sem orçamento"
+        lines.append(
+            f"- {c['categoria']}: R$ {c['gasto']:.2f} | {budget} | "
+            f"{c['variacao_mes_anterior']:+.2f} | R$ {c['media_meses_anteriores']:.2f}"
+        )
+    if digest['estabelecimentos']:
+        lines.append("Maiores gastos por estabelecimento:")
+        lines.extend(f"- {m['nome']}: R$ {m['total']:.2f} em {m['quantidade']} compra(s)" for m in digest['estabelecimentos'])
+    return "\n".join(lines)
@@ -0,0 +1,47 @@
+# auth_utils.py
+import database_utils
+
+# --- CREDENCIAIS SOB DEMANDA PARA O STREAMLIT-AUTHENTICATOR ---
+# O stauth.Authenticate espera um dicionário com TODOS os usuários. UserCredentials se passa
+# por esse dicionário, mas só busca no banco (via database_utils.get_user, com cache
+# limitado) o usuário que está fazendo login ou sendo reconhecido pelo cookie. O custo passa
+# a depender das sessões ativas, não do total de usuários cadastrados.
+
+
+class UserCredentials(dict):
+    """Dicionário {username: dados} preenchido sob demanda, um usuário por vez."""
+
+    def _load(self, username):
+        if dict.__contains__(self, username):
+            return True
+        user = database_utils.get_user(username) if isinstance(username, str) and username else None
+        if user is None:
+            return False
+        dict.__setitem__(self, username, {
+            "name": user['name'],
+            "email": user['email'],
+            "password": user['hashed_password'],
+            "logged_in": False,
+            "failed_login_attempts": 0,
+        })
+        return True
+
+    def __contains__(self, username):
+        return self._load(username)
+
+    def __getitem__(self, username):
+        if not self._load(username):
+            raise KeyError(username)
+        return dict.__getitem__(self, username)
+
+    def get(self, username, default=None):
+        return self[username] if self._load(username) else default
+
+
+def attach(authenticator):
+    """
+    Troca as credenciais do autenticador (criado com {'usernames': {}}) pelas sob demanda.
+    Depende da estrutura interna do streamlit-authenticator 0.3.2 (fixado no requirements.txt).
+    """
+    authenticator.authentication_handler.credentials['usernames'] = UserCredentials()
+    return authenticator
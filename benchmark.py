@@ -0,0 +1,373 @@
+# benchmark.py
+"""
+Benchmark do app com dados sintéticos, para comparar desempenho entre commits:
+
+    python benchmark.py --users 100 --expenses 100000
+    python benchmark.py --users 10000 --expenses 10000000 --output bench.json
+    python benchmark.py --database-url postgresql://... --reuse
+
+Gera usuários e despesas num banco local (SQLite por padrão), mede as funções de leitura
+e escrita do database_utils (com cache frio e quente), o pipeline pandas da aba de análise
+e o fluxo do chat contra o fake_openai_server.py, e imprime o resultado em JSON.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from functools import partial
+
+# O SDK da OpenAI exige uma chave ao ser criado; o benchmark só fala com o servidor falso.
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+import chart_utils
+import database_utils
+import fake_openai_server
+import llm_gateway
+import openai_utils
+import parser_utils
+import settlement_utils
+
+CATEGORIES = ["Diversão", "Alguel/Condomínio", "Carro", "Supermercado", "Limpeza", "Marmitas", "Investimento", "Saúde", "Luz/Internet", "Outros"]
+MERCHANTS = {
+    "Diversão": ["cinema", "show", "bar do zé", "streaming"],
+    "Alguel/Condomínio": ["aluguel", "condomínio"],
+    "Carro": ["posto shell", "uber", "estacionamento", "oficina"],
+    "Supermercado": ["mercado extra", "pão de açúcar", "carrefour", "feira"],
+    "Limpeza": ["diarista", "produtos de limpeza"],
+    "Marmitas": ["ifood", "marmita da ana", "restaurante"],
+    "Investimento": ["tesouro direto", "cdb"],
+    "Saúde": ["farmácia", "consulta", "academia"],
+    "Luz/Internet": ["conta de luz", "internet", "celular"],
+    "Outros": ["presente", "papelaria", "pet shop"],
+}
+PAYERS = ["Pessoa 1", "Pessoa 2", "Ambos"]
+INSERT_BATCH_SIZE = 50_000
+CHAT_MESSAGES = ["mercado extra 52,30", "uber 18", "conta de luz 210,90", "farmácia 35,50"]
+
+
+# --- GERAÇÃO DE DADOS SINTÉTICOS ---
+
+def generate(engine, users, expenses, months, seed):
+    """
+    Insere users usuários e expenses despesas distribuídas pelos últimos months meses e
+    recalcula o resumo mensal. Metade dos usuários usa o modo casal (pagador/split).
+    Retorna a lista de usernames.
+    """
+    rng = np.random.default_rng(seed)
+    usernames = [f"bench{i:06d}" for i in range(users)]
+    with engine.begin() as conn:
+        conn.execute(
+            text("INSERT INTO users (username, name, email, hashed_password) VALUES (:user, :name, :email, :pass)"),
+            [{'user': u, 'name': u, 'email': f"{u}@example.com", 'pass': "x"} for u in usernames]
+        )
+
+    insert_sql = text(
+        "INSERT INTO despesas (username, descricao, valor_centavos, categoria, data, pagador, split_pessoa1, split_pessoa2) "
+        "VALUES (:user, :desc, :val, :cat, :date, :payer, :s1, :s2)"
+    )
+    first_day = date.today().replace(day=1) - timedelta(days=31 * (months - 1))
+    span_days = (date.today() - first_day).days + 1
+    merchants = [(category, merchant) for category in CATEGORIES for merchant in MERCHANTS[category]]
+    remaining = expenses
+    while remaining > 0:
+        size = min(INSERT_BATCH_SIZE, remaining)
+        owners = rng.integers(0, users, size)
+        picks = rng.integers(0, len(merchants), size)
+        values = np.round(rng.lognormal(4.0, 1.0, size) * 100).astype(np.int64)
+        days = rng.integers(0, span_days, size)
+        payers = rng.integers(0, len(PAYERS), size)
+        rows = []
+        for owner, pick, value, day, payer in zip(owners.tolist(), picks.tolist(), values.tolist(), days.tolist(), payers.tolist()):
+            category, merchant = merchants[pick]
+            couple = owner % 2 == 0
+            rows.append({
+                'user': usernames[owner], 'desc': merchant, 'val': value, 'cat': category,
+                'date': first_day + timedelta(days=day),
+                'payer': PAYERS[payer] if couple else None,
+                's1': 50 if couple else None, 's2': 50 if couple else None,
+            })
+        with engine.begin() as conn:
+            conn.execute(insert_sql, rows)
+        remaining -= size
+    database_utils.rebuild_monthly_rollups()
+    return usernames
+
+
+# --- MEDIÇÃO ---
+
+def summarize(samples_ms):
+    samples = np.array(samples_ms)
+    return {
+        'count': len(samples),
+        'min_ms': round(float(samples.min()), 3),
+        'median_ms': round(float(np.median(samples)), 3),
+        'p95_ms': round(float(np.percentile(samples, 95)), 3),
+        'max_ms': round(float(samples.max()), 3),
+        'mean_ms': round(float(samples.mean()), 3),
+    }
+
+
+class Runner:
+    def __init__(self, repeat, rng):
+        self.repeat = repeat
+        self.rng = rng
+        self.results = {}
+
+    def measure(self, name, fn, setup=None, check=None):
+        """
+        Executa setup(i) (fora da medição) e depois fn(*args) repeat vezes. Com check, cada
+        resultado precisa passar em check(resultado); senão o benchmark para com RuntimeError,
+        em vez de publicar o tempo de um caminho de erro.
+        """
+        samples = []
+        for i in range(self.repeat):
+            args = setup(i) if setup else ()
+            start = time.perf_counter()
+            result = fn(*args)
+            samples.append((time.perf_counter() - start) * 1000)
+            if check and not check(result):
+                raise RuntimeError(f"{name} falhou: {result!r}")
+        self.results[name] = summarize(samples)
+
+    def pick(self, usernames):
+        return usernames[int(self.rng.integers(0, len(usernames)))]
+
+
+def bench_reads(runner, usernames):
+    today = date.today()
+    month = today.strftime("%Y-%m")
+    year_ago = (pd.Period(month, freq='M') - 11).strftime("%Y-%m")
+    quarter = (today.month - 1) // 3 + 1
+    reads = {
+        'get_user': lambda u: database_utils.get_user(u),
+        'get_monthly_expenses': lambda u: database_utils.get_monthly_expenses(u, month),
+        'get_quarterly_expenses': lambda u: database_utils.get_quarterly_expenses(u, today.year, quarter),
+        'get_expenses_between': lambda u: database_utils.get_expenses_between(u, date(today.year, 1, 1), today + timedelta(days=1)),
+        'get_monthly_category_totals': lambda u: database_utils.get_monthly_category_totals(u, year_ago, month),
+        'get_top_merchants': lambda u: database_utils.get_top_merchants(u, month),
+        'get_category_samples': lambda u: database_utils.get_category_samples(u),
+        'load_category_budgets': lambda u: database_utils.load_category_budgets(u, CATEGORIES),
+        'load_user_context': lambda u: database_utils.load_user_context(u, CATEGORIES),
+    }
+    for name, read in reads.items():
+        cached_fn = getattr(database_utils, name)
+
+        def cold(i, cached_fn=cached_fn):
+            cached_fn.clear()
+            return (runner.pick(usernames),)
+
+        def warm(i, read=read):
+            username = runner.pick(usernames)
+            read(username)
+            return (username,)
+
+        runner.measure(f"read.{name}.cold", read, cold)
+        runner.measure(f"read.{name}.warm", read, warm)
+
+
+def succeeded(result):
+    """Sucesso de uma escrita do database_utils: bool ou tupla que começa com o bool."""
+    return bool(result[0] if isinstance(result, tuple) else result)
+
+
+def bench_writes(runner, usernames):
+    engine = database_utils.get_engine()
+    today = date.today()
+
+    def latest_id(i):
+        username = runner.pick(usernames)
+        if not succeeded(database_utils.add_expense(username, "benchmark", 10.0, "Outros")):
+            raise RuntimeError("add_expense falhou na preparação de write.delete_expense")
+        with engine.connect() as conn:
+            expense_id = conn.execute(text("SELECT MAX(id) FROM despesas WHERE username = :user"), {'user': username}).scalar()
+        return username, expense_id
+
+    def import_chunk(i):
+        username = runner.pick(usernames)
+        # Metade do lote é igual em todas as rodadas: depois da primeira, cai na deduplicação.
+        chunk = [{'data': today, 'descricao': f"repetido {n}", 'valor': 1.0 + n, 'categoria': "Outros"} for n in range(25)]
+        chunk += [{'data': today, 'descricao': f"importado {i}-{n}", 'valor': 1.0 + n, 'categoria': "Outros"} for n in range(25)]
+        return username, [chunk]
+
+    items = [{'descricao': f"item {n}", 'valor': 5.0 + n, 'categoria': "Supermercado"} for n in range(5)]
+    runner.measure("write.add_expense", lambda u: database_utils.add_expense(u, "benchmark", 12.5, "Supermercado"),
+                   lambda i: (runner.pick(usernames),), check=succeeded)
+    runner.measure("write.add_expenses_5", lambda u: database_utils.add_expenses(u, items), lambda i: (runner.pick(usernames),), check=succeeded)
+    runner.measure("write.delete_expense", database_utils.delete_expense, latest_id, check=succeeded)
+    runner.measure("write.save_settings", lambda u: database_utils.save_settings(u, {'person1_name': "Ana", 'person2_name': "Bia"}),
+                   lambda i: (runner.pick(usernames),), check=succeeded)
+    runner.measure("write.save_category_budgets", lambda u: database_utils.save_category_budgets(u, {c: 500.0 for c in CATEGORIES}),
+                   lambda i: (runner.pick(usernames),), check=succeeded)
+    runner.measure("write.import_expense_chunks_50", database_utils.import_expense_chunks, import_chunk, check=succeeded)
+
+
+def bench_pandas(runner, usernames):
+    """O mesmo pipeline da aba de análise, medido em etapas sobre os dados de um usuário."""
+    month = date.today().strftime("%Y-%m")
+    budgets = {c: 500.0 for c in CATEGORIES}
+
+    def month_data(i):
+        username = runner.pick(usernames)
+        expenses_df, _ = database_utils.get_monthly_expenses(username, month)
+        month_totals = database_utils.get_monthly_category_totals(username, month, month)
+        return expenses_df, month_totals
+
+    def budget_analysis(expenses_df, month_totals):
+        return chart_utils.budget_analysis(month_totals, budgets)
+
+    def contribution_split(expenses_df, month_totals):
+        paid_p1, paid_p2 = settlement_utils.contributions(expenses_df, "Pessoa 1", "Pessoa 2")
+        expenses_df['Valor Pessoa 1'] = database_utils.to_reais(paid_p1)
+        expenses_df['Valor Pessoa 2'] = database_utils.to_reais(paid_p2)
+
+    def dataframe_prep(expenses_df, month_totals):
+        expenses_df['Valor'] = database_utils.to_reais(expenses_df['Centavos'])
+        display_cols = ['Data', 'Descrição', 'Categoria', 'Valor', 'Pagador', 'Valor Pessoa 1', 'Valor Pessoa 2']
+        expenses_df.reindex(columns=display_cols).fillna(0)
+
+    def year_data(i):
+        username = runner.pick(usernames)
+        today = date.today()
+        expenses_df, _ = database_utils.get_expenses_between(username, date(today.year, 1, 1), today + timedelta(days=1))
+        return (expenses_df,)
+
+    runner.measure("pandas.budget_analysis_rollup", budget_analysis, month_data)
+    runner.measure("pandas.contribution_split", contribution_split, month_data)
+    runner.measure("pandas.dataframe_prep", dataframe_prep, month_data)
+    runner.measure("pandas.settlement_year", lambda df: settlement_utils.compute_settlement(df, "Pessoa 1", "Pessoa 2"), year_data)
+    runner.measure("pandas.monthly_balance_year", lambda df: settlement_utils.monthly_balance(df, "Pessoa 1", "Pessoa 2"), year_data)
+
+
+def bench_chat(runner, usernames, run_id):
+    """Fluxo do chat (parser local + OpenAI falsa via llm_gateway), com cache frio e quente."""
+    def local(i):
+        username = runner.pick(usernames)
+        return [CHAT_MESSAGES[i % len(CHAT_MESSAGES)]], username, parser_utils.DEFAULT_CONFIDENCE_THRESHOLD
+
+    def llm_cold(i):
+        # Texto inédito a cada repetição: sempre um miss no cache do gateway. Limite > 1 força a OpenAI.
+        username = runner.pick(usernames)
+        return [f"{CHAT_MESSAGES[i % len(CHAT_MESSAGES)]} #{run_id}-{i}"], username, 1.01
+
+    def llm_warm(i):
+        username = runner.pick(usernames)
+        return [CHAT_MESSAGES[0]], username, 1.01
+
+    def multi_cold(i):
+        username = runner.pick(usernames)
+        message = ", ".join(f"{m} #{run_id}-{i}" for m in CHAT_MESSAGES)
+        return parser_utils.split_message(message), username, 1.01
+
+    def chat(segments, username, threshold):
+        llm_analyze = partial(openai_utils.analyze_expense_with_retry, username=username)
+        return parser_utils.analyze_batch(segments, CATEGORIES, username, llm_analyze, threshold)
+
+    runner.measure("chat.local_parser", chat, local)
+    runner.measure("chat.llm_cold", chat, llm_cold)
+    chat([CHAT_MESSAGES[0]], usernames[0], 1.01)
+    runner.measure("chat.llm_cached", chat, llm_warm)
+    runner.measure("chat.multi_expense_4_cold", chat, multi_cold)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark do Agente Financeiro com dados sintéticos.")
+    parser.add_argument("--database-url", default="sqlite:///benchmark.sqlite",
+                        help="Banco de destino (padrão: SQLite local benchmark.sqlite)")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--expenses", type=int, default=100_000, help="Total de despesas geradas")
+    parser.add_argument("--months", type=int, default=24, help="Meses cobertos pelas despesas")
+    parser.add_argument("--repeat", type=int, default=20, help="Repetições por medição")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reuse", action="store_true", help="Não gera dados se o banco já tiver despesas")
+    parser.add_argument("--llm-latency-ms", type=int, default=50, help="Latência simulada da OpenAI falsa")
+    parser.add_argument("--skip", nargs="*", default=[], choices=["reads", "writes", "pandas", "chat"])
+    parser.add_argument("--output", help="Arquivo JSON de saída (padrão: stdout)")
+    args = parser.parse_args(argv)
+
+    os.environ["DATABASE_URL"] = args.database_url
+    engine = database_utils.get_engine()
+    if not engine:
+        print("FALHOU: sem conexão com o banco.", file=sys.stderr)
+        return 1
+    database_utils.init_db()
+
+    generation_seconds = None
+    with engine.connect() as conn:
+        existing = conn.execute(text("SELECT COUNT(*) FROM despesas")).scalar()
+    if args.reuse and existing:
+        with engine.connect() as conn:
+            usernames = [r[0] for r in conn.execute(text("SELECT DISTINCT username FROM despesas ORDER BY username"))]
+    else:
+        if existing:
+            print("FALHOU: o banco já tem despesas; use --reuse ou um banco vazio.", file=sys.stderr)
+            return 1
+        start = time.perf_counter()
+        usernames = generate(engine, args.users, args.expenses, args.months, args.seed)
+        generation_seconds = round(time.perf_counter() - start, 2)
+
+    # Contadas antes das medições, que inserem despesas nos benches de escrita.
+    with engine.connect() as conn:
+        total_expenses = conn.execute(text("SELECT COUNT(*) FROM despesas")).scalar()
+
+    # A OpenAI falsa roda em processo, com um cache de gateway novo a cada execução.
+    server, base_url = fake_openai_server.start(latency_ms=args.llm_latency_ms)
+    cache_dir = tempfile.mkdtemp(prefix="bench-llm-")
+    openai_utils.gateway = llm_gateway.LLMGateway(api_key="benchmark", base_url=base_url,
+                                                  cache_path=os.path.join(cache_dir, "cache.sqlite"),
+                                                  requests_per_minute=None)
+
+    runner = Runner(args.repeat, np.random.default_rng(args.seed))
+    if "reads" not in args.skip:
+        bench_reads(runner, usernames)
+    if "writes" not in args.skip:
+        bench_writes(runner, usernames)
+    if "pandas" not in args.skip:
+        bench_pandas(runner, usernames)
+    if "chat" not in args.skip:
+        bench_chat(runner, usernames, int(time.time()))
+    server.shutdown()
+
+    report = {
+        'meta': {
+            'commit': _git_commit(),
+            'timestamp': datetime.now().isoformat(timespec="seconds"),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'backend': database_utils.get_backend().name,
+            'users': len(usernames),
+            'expenses': total_expenses,
+            'repeat': args.repeat,
+            'seed': args.seed,
+            'llm_latency_ms': args.llm_latency_ms,
+            'generation_seconds': generation_seconds,
+        },
+        'results': runner.results,
+    }
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+# cache_utils.py
+import copy
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+# --- CACHE VERSIONADO POR (USUÁRIO, DOMÍNIO) ---
+# Cada domínio de dados ('despesas', 'settings', 'budgets', 'users') tem um contador de
+# versão por usuário. As leituras cacheadas incluem as versões na chave; as funções de
+# escrita do database_utils apenas incrementam a versão do que alteraram. Assim, salvar uma
+# despesa invalida só as entradas daquele usuário, sem derrubar o cache dos demais.
+
+DEFAULT_TTL_SECONDS = 600
+DEFAULT_MAXSIZE = 1024
+
+_versions = {}
+_versions_lock = threading.Lock()
+
+
+def get_version(username, domain):
+    """Retorna a versão atual do domínio para o usuário."""
+    with _versions_lock:
+        return _versions.get((username, domain), 0)
+
+
+def invalidate(username, *domains):
+    """Incrementa a versão dos domínios informados, tornando obsoletas as entradas antigas."""
+    with _versions_lock:
+        for domain in domains:
+            _versions[(username, domain)] = _versions.get((username, domain), 0) + 1
+
+
+class LRUCache:
+    """Cache LRU limitado por tamanho, com expiração por TTL e seguro entre threads."""
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Retorna (True, valor) se a chave existir e não tiver expirado; senão (False, None)."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if self.ttl is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._data[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value):
+        with self._lock:
+            expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def _freeze(value):
+    """Converte argumentos não-hasheáveis (listas, dicts, sets) em chaves estáveis."""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(_freeze(v) for v in value))
+    return value
+
+
+def user_cache(*domains, ttl=DEFAULT_TTL_SECONDS, maxsize=DEFAULT_MAXSIZE, copy_values=True):
+    """
+    Decorador de leitura cacheada. O primeiro argumento da função é o username, e as versões
+    consultadas são as daquele usuário. O valor é copiado na saída para que quem chama possa
+    alterá-lo (ex.: adicionar colunas ao DataFrame) sem corromper o cache; copy_values=False
+    dispensa a cópia para valores que ninguém altera (ex.: specs de gráficos, classificador).
+    """
+    def decorator(func):
+        cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            username = args[0] if args else kwargs.get('username')
+            versions = tuple(get_version(username, d) for d in domains)
+            key = (versions, _freeze(args), _freeze(kwargs))
+            found, value = cache.get(key)
+            if not found:
+                value = func(*args, **kwargs)
+                cache.set(key, value)
+            return copy.deepcopy(value) if copy_values else value
+
+        wrapper.cache = cache
+        wrapper.clear = cache.clear
+        return wrapper
+    return decorator
@@ -0,0 +1,58 @@
+# chart_utils.py
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+import cache_utils
+import database_utils
+import settlement_utils
+
+# --- GRÁFICOS DA ABA DE ANÁLISE ---
+# Os gráficos são montados uma vez por (usuário, mês, versão dos dados) e guardados como
+# spec (dict) do Plotly: o cache usa a versão do domínio 'despesas' do usuário, então um rerun
+# que não mudou despesas (ex.: mexer em outro painel) reaproveita a spec em vez de refazer o
+# gráfico. As specs são só de leitura - o st.plotly_chart cria a própria figura a partir delas.
+
+
+def budget_analysis(month_totals, budgets):
+    """
+    DataFrame Categoria / Orçamento / Gasto / Saldo a partir do resumo mensal e dos limites
+    (em reais). As contas são feitas em centavos inteiros; só o resultado é convertido em reais.
+    """
+    budget_cents = pd.Series({cat: database_utils.to_cents(limite or 0) for cat, limite in budgets.items()}, dtype='int64')
+    cents = budget_cents.rename_axis('Categoria').to_frame('Orçamento')
+    cents['Gasto'] = month_totals.groupby('Categoria')['Centavos'].sum()
+    cents = cents.fillna(0).astype('int64')
+    cents['Saldo'] = cents['Orçamento'] - cents['Gasto']
+    return database_utils.to_reais(cents).reset_index()
+
+
+def _month_analysis(username, year_month, budgets):
+    month_totals = database_utils.get_monthly_category_totals(username, year_month, year_month)
+    return budget_analysis(month_totals, budgets)
+
+
+@cache_utils.user_cache('despesas', copy_values=False)
+def category_pie_spec(username, year_month, budgets):
+    analysis_df = _month_analysis(username, year_month, budgets)
+    fig_pie = px.pie(analysis_df, names='Categoria', values='Gasto', hole=.3)
+    fig_pie.update_traces(textposition='inside', textinfo='percent+label')
+    return fig_pie.to_dict()
+
+
+@cache_utils.user_cache('despesas', copy_values=False)
+def budget_bar_spec(username, year_month, budgets):
+    analysis_df = _month_analysis(username, year_month, budgets)
+    fig_bar = go.Figure()
+    fig_bar.add_trace(go.Bar(x=analysis_df['Categoria'], y=analysis_df['Gasto'], name='Gasto Real', marker_color='indianred'))
+    fig_bar.add_trace(go.Scatter(x=analysis_df['Categoria'], y=analysis_df['Orçamento'], name='Orçamento Definido', mode='lines+markers', line=dict(color='royalblue', dash='dash')))
+    return fig_bar.to_dict()
+
+
+@cache_utils.user_cache('despesas', copy_values=False)
+def contribution_pie_spec(username, year_month, person1_name, person2_name):
+    expenses_df, _ = database_utils.get_monthly_expenses(username, year_month)
+    paid_p1, paid_p2 = settlement_utils.contributions(expenses_df, person1_name, person2_name)
+    contribution_data = pd.DataFrame({'Pessoa': [person1_name, person2_name], 'Valor Pago': [database_utils.to_reais(int(paid_p1.sum())), database_utils.to_reais(int(paid_p2.sum()))]})
+    fig_contrib = px.pie(contribution_data, names='Pessoa', values='Valor Pago', title='Quem Pagou Mais no Mês', hole=0.4, color_discrete_sequence=px.colors.sequential.RdBu)
+    return fig_contrib.to_dict()
@@ -1,12 +1,40 @@
 # database_utils.py
 import streamlit as st
-import psycopg2
-from datetime import datetime
+import threading
+from collections import defaultdict
+from contextlib import nullcontext
+from datetime import datetime, date, timedelta
+from decimal import Decimal, ROUND_HALF_UP
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import bindparam, text
+
+import cache_utils
+import db_backends
+import db_metrics
+import migrations
 
 # --- GERENCIAMENTO DE CONEXÃO COM CACHE ---
 
+def _database_config():
+    """Seção [database] do secrets.toml (vazia se não houver secrets, ex.: só DATABASE_URL)."""
+    try:
+        return dict(st.secrets.get('database', {}))
+    except Exception:
+        return {}
+
+# Pool de conexões: sobrescreva em [database] (pool_size, max_overflow, pool_pre_ping, pool_recycle).
+# O pre-ping e o recycle evitam erros com conexões que o servidor derrubou por inatividade.
+POOL_DEFAULTS = {'pool_size': 5, 'max_overflow': 10, 'pool_pre_ping': True, 'pool_recycle': 1800}
+
+def _pool_options(config):
+    return {key: type(default)(config.get(key, default)) for key, default in POOL_DEFAULTS.items()}
+
+@st.cache_resource
+def get_backend():
+    """Backend (Postgres ou SQLite) escolhido pela configuração; ver db_backends."""
+    backend, _ = db_backends.resolve(_database_config())
+    return backend
+
 @st.cache_resource
 def get_engine():
     """
@@ -14,86 +42,322 @@ def get_engine():
     Isso evita criar novas conexões a cada interação no app.
     """
     try:
-        connection_string = st.secrets['database']['connection_string']
-        # SQLAlchemy prefere o dialeto 'postgresql+psycopg2'
-        if connection_string.startswith("postgresql://"):
-            connection_string = connection_string.replace("postgresql://", "postgresql+psycopg2://", 1)
-        return create_engine(connection_string)
+        config = _database_config()
+        backend, connection_string = db_backends.resolve(config)
+        engine = backend.create_engine(connection_string, _pool_options(config))
+        # Mede latência, linhas e ponto de chamada de cada statement (ver db_metrics).
+        return db_metrics.instrument(engine, float(config.get('slow_query_ms', db_metrics.DEFAULT_SLOW_QUERY_MS)))
     except Exception as e:
         st.error(f"Erro ao criar engine de conexão: {e}")
         return None
 
 # --- INICIALIZAÇÃO DO BANCO DE DADOS ---
+# O esquema é mantido por migrações versionadas (ver migrations.py). A verificação roda uma
+# única vez por processo: nas execuções seguintes do script, init_db() não toca no banco.
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
 def init_db():
-    """Cria todas as tabelas no banco de dados se elas não existirem."""
-    engine = get_engine()
-    if engine:
-        try:
-            with engine.connect() as conn:
-                conn.execute(text("""
-                CREATE TABLE IF NOT EXISTS users (
-                    username VARCHAR(255) PRIMARY KEY, name VARCHAR(255) NOT NULL,
-                    email VARCHAR(255) NOT NULL UNIQUE, hashed_password TEXT NOT NULL
-                )"""))
-                conn.execute(text("""
-                CREATE TABLE IF NOT EXISTS despesas (
-                    id SERIAL PRIMARY KEY, username VARCHAR(255) NOT NULL, descricao TEXT NOT NULL,
-                    valor REAL NOT NULL, categoria VARCHAR(255) NOT NULL, data DATE NOT NULL,
-                    pagador VARCHAR(255), split_pessoa1 REAL, split_pessoa2 REAL
-                )"""))
-                conn.execute(text("""
-                CREATE TABLE IF NOT EXISTS orcamentos_categoria (
-                    username VARCHAR(255) NOT NULL, categoria VARCHAR(255) NOT NULL,
-                    limite REAL NOT NULL, PRIMARY KEY (username, categoria)
-                )"""))
-                conn.execute(text("""
-                CREATE TABLE IF NOT EXISTS app_settings (
-                    username VARCHAR(255) NOT NULL, key VARCHAR(255) NOT NULL,
-                    value TEXT NOT NULL, PRIMARY KEY (username, key)
-                )"""))
-                conn.commit()
-        except Exception as e:
-            st.error(f"Erro ao inicializar tabelas: {e}")
+    """Aplica as migrações pendentes na primeira chamada do processo; depois, não faz nada."""
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        engine = get_engine()
+        if engine:
+            try:
+                migrations.migrate(engine, get_backend())
+                _schema_ready = True
+            except Exception as e:
+                st.error(f"Erro ao inicializar tabelas: {e}")
 
 # --- FUNÇÕES DE LEITURA COM CACHE ---
 
-@st.cache_data
-def fetch_all_users():
-    """Busca todos os usuários do banco (executa apenas uma vez por sessão)."""
+# Cache pequeno e limitado só dos usuários que fizeram login recentemente.
+@cache_utils.user_cache('users', maxsize=256, ttl=300)
+def get_user(username):
+    """
+    Busca um único usuário pelo username (sem diferenciar maiúsculas, como o login do
+    streamlit-authenticator), usando o índice em LOWER(username). Retorna dict ou None.
+    """
+    engine = get_engine()
+    if engine:
+        sql = text("SELECT username, name, email, hashed_password FROM users WHERE LOWER(username) = :user LIMIT 1")
+        with engine.connect() as conn:
+            r = conn.execute(sql, {'user': username.lower()}).first()
+            if r:
+                return {'username': r[0], 'name': r[1], 'email': r[2], 'hashed_password': r[3]}
+    return None
+
+def find_user_conflict(username, email):
+    """
+    Verifica, por consultas indexadas, se o username ou o email já estão em uso.
+    Retorna 'username', 'email' ou None.
+    """
     engine = get_engine()
     if engine:
         with engine.connect() as conn:
-            users = conn.execute(text("SELECT username, name, email, hashed_password FROM users")).fetchall()
-            return [{'username': r[0], 'name': r[1], 'email': r[2], 'hashed_password': r[3]} for r in users]
-    return []
+            if conn.execute(text("SELECT 1 FROM users WHERE LOWER(username) = :user"), {'user': username.lower()}).first():
+                return 'username'
+            if conn.execute(text("SELECT 1 FROM users WHERE email = :email"), {'email': email}).first():
+                return 'email'
+    return None
+
+# --- VALORES EM CENTAVOS ---
+# O banco guarda dinheiro em centavos inteiros (valor_centavos, limite_centavos,
+# total_centavos) e os splits em percentual inteiro. As funções de escrita recebem reais e
+# convertem com to_cents; as leituras devolvem centavos em colunas int64 ('Centavos'), e a
+# interface só divide por 100 na hora de exibir. Assim toda soma é exata, no SQL e no NumPy.
+
+def to_cents(valor):
+    """Converte um valor em reais (float, str, Decimal ou int) em centavos inteiros, arredondando meio centavo para cima."""
+    return int((Decimal(str(valor)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def to_reais(centavos):
+    """Centavos (inteiro, array ou Series) em reais, só para exibição."""
+    return centavos / 100
+
+def _percent(split):
+    """Split em percentual inteiro (ou None), aceitando os tipos do NumPy/pandas."""
+    return None if split is None or pd.isna(split) else int(round(float(split)))
+
+# --- CONSULTAS POR INTERVALO DE DATAS ---
+# Todas as buscas de despesas usam intervalos semiabertos [início, fim) sobre a coluna
+# 'data', o que permite ao Postgres usar o índice (username, data).
+
+EXPENSE_COLUMNS = ['id', 'username', 'Descrição', 'Centavos', 'Categoria', 'Data', 'Pagador', 'Split Pessoa 1', 'Split Pessoa 2']
+# Tipos explícitos no read_sql: centavos em int64 e splits em Int8 (nulo no modo individual).
+EXPENSE_DTYPES = {'id': 'int64', 'valor_centavos': 'int64', 'split_pessoa1': 'Int8', 'split_pessoa2': 'Int8'}
+
+_EXPENSES_RANGE_SQL = """
+    SELECT id, username, descricao, valor_centavos, categoria, data, pagador, split_pessoa1, split_pessoa2
+    FROM despesas
+    WHERE username = :user AND data >= :start AND data < :end
+    ORDER BY data DESC
+"""
+
+def month_bounds(year_month):
+    """Converte 'AAAA-MM' no intervalo semiaberto [primeiro dia do mês, primeiro dia do mês seguinte)."""
+    start = datetime.strptime(year_month, "%Y-%m").date()
+    end = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return start, end
 
-@st.cache_data
+def quarter_bounds(year, quarter):
+    """Retorna o intervalo semiaberto [início, fim) do trimestre (1 a 4) informado."""
+    if quarter not in (1, 2, 3, 4):
+        raise ValueError("O trimestre deve estar entre 1 e 4.")
+    start = date(year, 3 * (quarter - 1) + 1, 1)
+    end = date(year + 1, 1, 1) if quarter == 4 else date(year, 3 * quarter + 1, 1)
+    return start, end
+
+def _empty_expenses_df():
+    return pd.DataFrame(columns=EXPENSE_COLUMNS).astype({'id': 'int64', 'Centavos': 'int64', 'Split Pessoa 1': 'Int8', 'Split Pessoa 2': 'Int8'})
+
+def _read_expenses(sql, engine, params):
+    df = pd.read_sql(sql, engine, params=params, dtype=EXPENSE_DTYPES)
+    df.columns = EXPENSE_COLUMNS
+    return df
+
+def _query_expenses_range(username, start_date, end_date):
+    """Executa a consulta por intervalo (sem cache) e devolve (DataFrame, total em centavos)."""
+    engine = get_engine()
+    if engine:
+        df = _read_expenses(text(_EXPENSES_RANGE_SQL), engine, {'user': username, 'start': start_date, 'end': end_date})
+        return df, int(df['Centavos'].sum())
+    return _empty_expenses_df(), 0
+
+@cache_utils.user_cache('despesas')
+def get_expenses_between(username, start_date, end_date):
+    """Busca despesas no intervalo semiaberto [start_date, end_date) (resultado cacheado)."""
+    return _query_expenses_range(username, start_date, end_date)
+
+@cache_utils.user_cache('despesas')
 def get_monthly_expenses(username, year_month):
     """Busca despesas mensais (resultado cacheado)."""
+    try:
+        start, end = month_bounds(year_month)
+    except ValueError:
+        return _empty_expenses_df(), 0
+    return _query_expenses_range(username, start, end)
+
+@cache_utils.user_cache('despesas')
+def get_quarterly_expenses(username, year, quarter):
+    """Busca despesas de um trimestre (resultado cacheado)."""
+    start, end = quarter_bounds(year, quarter)
+    return _query_expenses_range(username, start, end)
+
+def check_month_query_plan(username, year_month):
+    """
+    Roda EXPLAIN na consulta mensal e levanta RuntimeError se o banco varrer a tabela
+    'despesas' inteira em vez de usar o índice (username, data).
+    """
+    engine = get_engine()
+    if not engine:
+        raise RuntimeError("Falha na conexão com o banco.")
+    start, end = month_bounds(year_month)
+    with engine.begin() as conn:
+        uses_index, nodes = get_backend().uses_index(conn, _EXPENSES_RANGE_SQL, {'user': username, 'start': start, 'end': end}, 'despesas')
+    if not uses_index:
+        raise RuntimeError("A consulta mensal caiu em Seq Scan na tabela 'despesas'.")
+    return nodes
+
+# --- HISTÓRICO PAGINADO (KEYSET) ---
+# As páginas seguem a ordem (data, id) decrescente e cada página começa logo após o cursor
+# (data, id) da última linha da anterior. Com o índice (username, data, id), o custo de uma
+# página não depende de quantas despesas o usuário tem nem de quão fundo ele navegou.
+
+HISTORY_PAGE_SIZE = 50
+
+def _like_pattern(term):
+    """'%termo%' com os curingas do próprio termo escapados."""
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+@cache_utils.user_cache('despesas')
+def get_expense_page(username, filters=None, after=None, limit=HISTORY_PAGE_SIZE):
+    """
+    Uma página do histórico. filters aceita 'categorias' (lista), 'pagador', 'valor_min',
+    'valor_max' (em reais) e 'busca' (trecho da descrição); after é o cursor (data, id) devolvido pela
+    página anterior. Retorna (DataFrame com EXPENSE_COLUMNS, próximo cursor ou None).
+    """
+    filters = filters or {}
+    conditions, params = ["username = :user"], {'user': username, 'limit': limit + 1}
+    if filters.get('categorias'):
+        conditions.append("categoria IN :categorias")
+        params['categorias'] = list(filters['categorias'])
+    if filters.get('pagador'):
+        conditions.append("pagador = :pagador")
+        params['pagador'] = filters['pagador']
+    if filters.get('valor_min') is not None:
+        conditions.append("valor_centavos >= :valor_min")
+        params['valor_min'] = to_cents(filters['valor_min'])
+    if filters.get('valor_max') is not None:
+        conditions.append("valor_centavos <= :valor_max")
+        params['valor_max'] = to_cents(filters['valor_max'])
+    if filters.get('busca'):
+        conditions.append(get_backend().contains_sql('descricao', 'busca'))
+        params['busca'] = _like_pattern(filters['busca'])
+    if after is not None:
+        conditions.append("(data, id) < (:after_data, :after_id)")
+        params['after_data'], params['after_id'] = after
+    sql = text(f"""
+        SELECT id, username, descricao, valor_centavos, categoria, data, pagador, split_pessoa1, split_pessoa2
+        FROM despesas WHERE {' AND '.join(conditions)}
+        ORDER BY data DESC, id DESC LIMIT :limit
+    """)
+    if 'categorias' in params:
+        sql = sql.bindparams(bindparam('categorias', expanding=True))
+    engine = get_engine()
+    if not engine:
+        return _empty_expenses_df(), None
+    df = _read_expenses(sql, engine, params)
+    next_cursor = None
+    if len(df) > limit:
+        df = df.iloc[:limit]
+        last = df.iloc[-1]
+        next_cursor = (_as_date(last['Data']), int(last['id']))
+    return df, next_cursor
+
+# --- EXPORTAÇÃO EM FLUXO ---
+# A exportação lê o intervalo por um cursor do lado do servidor (stream_results) em lotes de
+# EXPORT_CHUNK_SIZE linhas e grava cada lote no arquivo antes de ler o próximo: a memória
+# usada é a de um lote, qualquer que seja o tamanho do histórico. O valor sai em reais como
+# Decimal (texto '12.30' no CSV, decimal(18, 2) no Parquet), sem passar por float. Parquet exige o pyarrow.
+
+EXPORT_CHUNK_SIZE = 5000
+EXPORT_COLUMNS = ['ID', 'Data', 'Descrição', 'Categoria', 'Valor', 'Pagador', 'Split Pessoa 1', 'Split Pessoa 2']
+
+_EXPORT_SQL = """
+    SELECT id, data, descricao, categoria, valor_centavos, pagador, split_pessoa1, split_pessoa2
+    FROM despesas
+    WHERE username = :user AND data >= :start AND data < :end
+    ORDER BY data, id
+"""
+
+def iter_expense_chunks(username, start_date, end_date, chunk_size=EXPORT_CHUNK_SIZE):
+    """Gera DataFrames de até chunk_size despesas do intervalo semiaberto [start_date, end_date), em ordem de data."""
+    engine = get_engine()
+    if not engine:
+        raise RuntimeError("Falha na conexão com o banco.")
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(
+            text(_EXPORT_SQL), {'user': username, 'start': start_date, 'end': end_date}
+        )
+        for rows in result.partitions(chunk_size):
+            chunk = pd.DataFrame.from_records([tuple(r) for r in rows], columns=EXPORT_COLUMNS)
+            chunk['Data'] = pd.to_datetime(chunk['Data']).dt.date
+            chunk['Valor'] = [Decimal(c).scaleb(-2) for c in chunk['Valor'].tolist()]
+            chunk[['Split Pessoa 1', 'Split Pessoa 2']] = chunk[['Split Pessoa 1', 'Split Pessoa 2']].astype('Int16')
+            yield chunk
+
+def _parquet_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ('ID', pa.int64()), ('Data', pa.date32()), ('Descrição', pa.string()), ('Categoria', pa.string()),
+        ('Valor', pa.decimal128(18, 2)), ('Pagador', pa.string()), ('Split Pessoa 1', pa.int16()), ('Split Pessoa 2', pa.int16()),
+    ])
+
+def export_expenses(username, start_date, end_date, file_format, output, chunk_size=EXPORT_CHUNK_SIZE, progress=None):
+    """
+    Grava as despesas de [start_date, end_date) em output (caminho ou arquivo binário) como
+    'csv' (UTF-8 com BOM, abre direto no Excel) ou 'parquet'. progress(linhas) é chamado a
+    cada lote. Retorna o número de linhas exportadas.
+    """
+    chunks = iter_expense_chunks(username, start_date, end_date, chunk_size)
+    rows = 0
+    if file_format == 'csv':
+        with (open(output, 'wb') if isinstance(output, str) else nullcontext(output)) as f:
+            f.write('\ufeff'.encode('utf-8'))
+            for i, chunk in enumerate(chunks):
+                f.write(chunk.to_csv(index=False, header=(i == 0)).encode('utf-8'))
+                rows += len(chunk)
+                if progress: progress(rows)
+            if rows == 0:
+                f.write((','.join(EXPORT_COLUMNS) + '\n').encode('utf-8'))
+    elif file_format == 'parquet':
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Exportar em Parquet requer o pacote pyarrow.")
+        schema = _parquet_schema()
+        with pq.ParquetWriter(output, schema) as writer:
+            for chunk in chunks:
+                writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+                rows += len(chunk)
+                if progress: progress(rows)
+    else:
+        raise ValueError(f"Formato de exportação desconhecido: {file_format}")
+    return rows
+
+@cache_utils.user_cache('despesas')
+def get_category_samples(username, limit=2000):
+    """Busca as descrições/categorias mais recentes do usuário para treinar o classificador local."""
     engine = get_engine()
     if engine:
-        sql = text("SELECT * FROM despesas WHERE username = :user AND TO_CHAR(data, 'YYYY-MM') = :month ORDER BY data DESC")
-        df = pd.read_sql(sql, engine, params={'user': username, 'month': year_month})
-        df.columns = ['id', 'username', 'Descrição', 'Valor', 'Categoria', 'Data', 'Pagador', 'Split Pessoa 1', 'Split Pessoa 2']
-        return df, df['Valor'].sum()
-    empty_df = pd.DataFrame(columns=['id', 'username', 'Descrição', 'Valor', 'Categoria', 'Data', 'Pagador', 'Split Pessoa 1', 'Split Pessoa 2'])
-    return empty_df, 0.0
-
-@st.cache_data
+        sql = text("SELECT descricao, categoria FROM despesas WHERE username = :user ORDER BY data DESC LIMIT :limit")
+        with engine.connect() as conn:
+            return [(r[0], r[1]) for r in conn.execute(sql, {'user': username, 'limit': limit}).fetchall()]
+    return []
+
+@cache_utils.user_cache('budgets')
 def load_category_budgets(username, categories):
-    """Carrega orçamentos por categoria (resultado cacheado)."""
+    """Carrega orçamentos por categoria, em reais (resultado cacheado)."""
     engine = get_engine()
     if engine:
-        sql = text("SELECT categoria, limite FROM orcamentos_categoria WHERE username = :user")
+        sql = text("SELECT categoria, limite_centavos FROM orcamentos_categoria WHERE username = :user")
         with engine.connect() as conn:
             result = conn.execute(sql, {'user': username}).fetchall()
-            budgets = {r[0]: r[1] for r in result}
+            budgets = {r[0]: to_reais(r[1]) for r in result}
             for cat in categories:
                 if cat not in budgets: budgets[cat] = 0.0
             return budgets
     return {cat: 0.0 for cat in categories}
 
-@st.cache_data
+@cache_utils.user_cache('settings')
 def load_setting(username, key, default_value=None):
     """Carrega uma configuração específica (resultado cacheado)."""
     engine = get_engine()
@@ -104,68 +368,336 @@ def load_setting(username, key, default_value=None):
             return result[0] if result else default_value
     return default_value
 
-# --- FUNÇÕES DE ESCRITA (NÃO USAM CACHE) ---
+@cache_utils.user_cache('settings', 'budgets')
+def load_user_context(username, categories=()):
+    """
+    Carrega todas as configurações e orçamentos do usuário numa única consulta, cacheados
+    como uma unidade. Retorna {'settings': {chave: valor}, 'budgets': {categoria: limite em reais}},
+    com limite 0.0 para as categorias informadas que ainda não têm orçamento.
+    """
+    context = {'settings': {}, 'budgets': {cat: 0.0 for cat in categories}}
+    engine = get_engine()
+    if engine:
+        sql = text("""
+            SELECT 'setting' AS tipo, key AS nome, value AS valor, NULL AS limite FROM app_settings WHERE username = :user
+            UNION ALL
+            SELECT 'budget' AS tipo, categoria AS nome, NULL AS valor, limite_centavos AS limite FROM orcamentos_categoria WHERE username = :user
+        """)
+        with engine.connect() as conn:
+            for tipo, nome, valor, limite in conn.execute(sql, {'user': username}):
+                if tipo == 'setting':
+                    context['settings'][nome] = valor
+                else:
+                    context['budgets'][nome] = to_reais(limite)
+    return context
+
+# --- RESUMO MENSAL POR CATEGORIA (ROLLUP) ---
+# resumo_mensal_categoria guarda (username, mes, categoria) -> total_centavos, quantidade. As funções
+# de escrita atualizam o resumo na mesma transação da despesa, então as análises por
+# categoria e as tendências não precisam ler as linhas brutas.
+
+def _rollup_upsert_sql():
+    return text(get_backend().upsert_sql(
+        'resumo_mensal_categoria', ['username', 'mes', 'categoria', 'total_centavos', 'quantidade'], ['username', 'mes', 'categoria'],
+        "total_centavos = resumo_mensal_categoria.total_centavos + EXCLUDED.total_centavos, quantidade = resumo_mensal_categoria.quantidade + EXCLUDED.quantidade"
+    ))
+
+def _rollup_aggregate_sql(where=""):
+    month = get_backend().month_trunc('data')
+    return f"""
+    SELECT username, {month} AS mes, categoria, SUM(valor_centavos) AS total_centavos, COUNT(*) AS quantidade
+    FROM despesas {where}
+    GROUP BY username, {month}, categoria
+"""
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value)[:10], "%Y-%m-%d").date()
+
+def _apply_rollup_deltas(conn, username, rows, sign=1):
+    """
+    Soma (sign=1) ou subtrai (sign=-1) as linhas (data, centavos, categoria) do resumo mensal,
+    usando a conexão/transação de quem chamou.
+    """
+    deltas = defaultdict(lambda: [0, 0])
+    for data, centavos, categoria in rows:
+        delta = deltas[(_as_date(data).replace(day=1), categoria)]
+        delta[0] += sign * int(centavos)
+        delta[1] += sign
+    if not deltas:
+        return
+    conn.execute(_rollup_upsert_sql(), [
+        {'username': username, 'mes': mes, 'categoria': cat, 'total_centavos': total, 'quantidade': qtd}
+        for (mes, cat), (total, qtd) in deltas.items()
+    ])
+    if sign < 0:
+        conn.execute(text("DELETE FROM resumo_mensal_categoria WHERE username = :user AND quantidade <= 0"), {'user': username})
+
+def rebuild_monthly_rollups(username=None):
+    """Recalcula o resumo mensal a partir de 'despesas' (de um usuário ou de todos)."""
+    engine = get_engine()
+    if not engine:
+        return False
+    where, params = ("WHERE username = :user", {'user': username}) if username else ("", {})
+    with engine.begin() as conn:
+        conn.execute(text(f"DELETE FROM resumo_mensal_categoria {where}"), params)
+        conn.execute(text(f"INSERT INTO resumo_mensal_categoria (username, mes, categoria, total_centavos, quantidade) {_rollup_aggregate_sql(where)}"), params)
+    if username:
+        cache_utils.invalidate(username, 'despesas')
+    else:
+        get_monthly_category_totals.clear()
+    return True
+
+def verify_monthly_rollups(username=None):
+    """
+    Compara o resumo mensal com a agregação das despesas, ao centavo. Retorna a lista de divergências
+    (username, mes, categoria, esperado, armazenado); lista vazia significa resumo íntegro.
+    """
+    engine = get_engine()
+    if not engine:
+        raise RuntimeError("Falha na conexão com o banco.")
+    where, params = ("WHERE username = :user", {'user': username}) if username else ("", {})
+    with engine.connect() as conn:
+        expected = {(r[0], _as_date(r[1]), r[2]): (int(r[3]), int(r[4])) for r in conn.execute(text(_rollup_aggregate_sql(where)), params)}
+        stored = {(r[0], _as_date(r[1]), r[2]): (int(r[3]), int(r[4])) for r in conn.execute(text(f"SELECT username, mes, categoria, total_centavos, quantidade FROM resumo_mensal_categoria {where}"), params)}
+    mismatches = []
+    for key in sorted(expected.keys() | stored.keys()):
+        exp = expected.get(key, (0, 0))
+        got = stored.get(key, (0, 0))
+        if exp != got:
+            mismatches.append((*key, exp, got))
+    return mismatches
+
+@cache_utils.user_cache('despesas')
+def get_monthly_category_totals(username, start_month, end_month):
+    """
+    Lê do resumo mensal os totais por categoria de start_month até end_month (inclusive),
+    ambos no formato 'AAAA-MM'. Retorna DataFrame com 'Mês', 'Categoria', 'Centavos' (int64), 'Quantidade'.
+    """
+    columns = ['Mês', 'Categoria', 'Centavos', 'Quantidade']
+    engine = get_engine()
+    if engine:
+        start, _ = month_bounds(start_month)
+        _, end = month_bounds(end_month)
+        sql = text("""
+            SELECT mes, categoria, total_centavos, quantidade FROM resumo_mensal_categoria
+            WHERE username = :user AND mes >= :start AND mes < :end
+            ORDER BY mes
+        """)
+        df = pd.read_sql(sql, engine, params={'user': username, 'start': start, 'end': end}, dtype={'total_centavos': 'int64', 'quantidade': 'int64'})
+        df.columns = columns
+        df['Mês'] = pd.to_datetime(df['Mês']).dt.strftime('%Y-%m')
+        return df
+    return pd.DataFrame(columns=columns).astype({'Centavos': 'int64', 'Quantidade': 'int64'})
+
+@cache_utils.user_cache('despesas')
+def get_top_merchants(username, year_month, limit=5):
+    """
+    Os limit estabelecimentos (descrições, sem diferenciar maiúsculas) com maior gasto no mês.
+    A agregação e o corte ficam no banco. Retorna [(descricao, total em centavos, quantidade)].
+    """
+    engine = get_engine()
+    if engine:
+        start, end = month_bounds(year_month)
+        sql = text("""
+            SELECT LOWER(TRIM(descricao)) AS estabelecimento, SUM(valor_centavos) AS total, COUNT(*) AS quantidade
+            FROM despesas WHERE username = :user AND data >= :start AND data < :end
+            GROUP BY LOWER(TRIM(descricao)) ORDER BY total DESC, estabelecimento LIMIT :limit
+        """)
+        with engine.connect() as conn:
+            rows = conn.execute(sql, {'user': username, 'start': start, 'end': end, 'limit': limit}).fetchall()
+        return [(r[0], int(r[1]), int(r[2])) for r in rows]
+    return []
+
+# --- FUNÇÕES DE ESCRITA (INVALIDAM APENAS O DOMÍNIO DO USUÁRIO) ---
 
 def add_user(username, name, email, hashed_password):
     """Adiciona um novo usuário ao banco."""
     engine = get_engine()
     sql = text("INSERT INTO users (username, name, email, hashed_password) VALUES (:user, :name, :email, :pass)")
     if engine:
+        conflict = find_user_conflict(username, email)
+        if conflict == 'username':
+            return False, "Esse username já está em uso."
+        if conflict == 'email':
+            return False, "Esse email já está cadastrado."
         try:
             with engine.connect() as conn:
                 conn.execute(sql, {'user': username, 'name': name, 'email': email, 'pass': hashed_password})
                 conn.commit()
+            # Derruba uma eventual busca negativa ("usuário não existe") já cacheada.
+            cache_utils.invalidate(username, 'users')
+            cache_utils.invalidate(username.lower(), 'users')
             return True, "Usuário registrado com sucesso!"
         except Exception as e:
             # Captura erros de integridade (ex: username já existe)
             return False, f"Username ou email já podem existir."
     return False, "Falha na conexão com o banco."
 
-def add_expense(username, descricao, valor, categoria, pagador=None, split_p1=None, split_p2=None):
-    """Adiciona uma nova despesa."""
-    data_str = datetime.now().strftime("%Y-%m-%d")
-    sql = text("INSERT INTO despesas (username, descricao, valor, categoria, data, pagador, split_pessoa1, split_pessoa2) VALUES (:user, :desc, :val, :cat, :date, :payer, :s1, :s2)")
+def add_expense(username, descricao, valor, categoria, pagador=None, split_p1=None, split_p2=None, data=None):
+    """Adiciona uma nova despesa de valor em reais (data padrão: hoje)."""
+    data_str = data or datetime.now().strftime("%Y-%m-%d")
+    centavos = to_cents(valor)
+    sql = text("INSERT INTO despesas (username, descricao, valor_centavos, categoria, data, pagador, split_pessoa1, split_pessoa2) VALUES (:user, :desc, :val, :cat, :date, :payer, :s1, :s2)")
     engine = get_engine()
     if engine:
         try:
-            with engine.connect() as conn:
-                conn.execute(sql, {'user': username, 'desc': descricao, 'val': float(valor), 'cat': categoria, 'date': data_str, 'payer': pagador, 's1': split_p1, 's2': split_p2})
-                conn.commit()
+            with engine.begin() as conn:
+                conn.execute(sql, {'user': username, 'desc': descricao, 'val': centavos, 'cat': categoria, 'date': data_str, 'payer': pagador, 's1': _percent(split_p1), 's2': _percent(split_p2)})
+                _apply_rollup_deltas(conn, username, [(data_str, centavos, categoria)])
+            cache_utils.invalidate(username, 'despesas')
             return True, f"Despesa '{descricao}' adicionada."
         except Exception as e:
             return False, f"Erro ao adicionar despesa: {e}"
     return False, "Falha na conexão."
 
+def add_expenses(username, items, pagador=None, split_p1=None, split_p2=None):
+    """
+    Adiciona várias despesas numa única transação (um executemany). Cada item é um dict com
+    'descricao', 'valor' (em reais), 'categoria' e, opcionalmente, 'data' (padrão: hoje).
+    """
+    if not items:
+        return False, "Nenhuma despesa para adicionar."
+    today_str = datetime.now().strftime("%Y-%m-%d")
+    sql = text("INSERT INTO despesas (username, descricao, valor_centavos, categoria, data, pagador, split_pessoa1, split_pessoa2) VALUES (:user, :desc, :val, :cat, :date, :payer, :s1, :s2)")
+    params = [
+        {'user': username, 'desc': item['descricao'], 'val': to_cents(item['valor']), 'cat': item['categoria'],
+         'date': item.get('data') or today_str, 'payer': pagador, 's1': _percent(split_p1), 's2': _percent(split_p2)}
+        for item in items
+    ]
+    engine = get_engine()
+    if engine:
+        try:
+            with engine.begin() as conn:
+                conn.execute(sql, params)
+                _apply_rollup_deltas(conn, username, [(p['date'], p['val'], p['cat']) for p in params])
+            cache_utils.invalidate(username, 'despesas')
+            if len(params) == 1:
+                return True, f"Despesa '{items[0]['descricao']}' adicionada."
+            return True, f"{len(params)} despesas adicionadas."
+        except Exception as e:
+            return False, f"Erro ao adicionar despesas: {e}"
+    return False, "Falha na conexão."
+
+def import_expense_chunks(username, chunks):
+    """
+    Grava lotes de despesas importadas (dicts com 'data', 'descricao', 'valor' em reais e
+    'categoria'), cada um na sua transação. Linhas já importadas são puladas pelo índice único
+    (username, hash_importacao, ocorrencia), então reimportar um arquivo não duplica nada.
+    Retorna (sucesso, inseridas, duplicadas, mensagem).
+    """
+    columns = ['username', 'descricao', 'valor_centavos', 'categoria', 'data', 'hash_importacao', 'ocorrencia']
+    engine = get_engine()
+    if not engine:
+        return False, 0, 0, "Falha na conexão."
+    inserted = duplicates = 0
+    # Linhas iguais têm a mesma data e os extratos vêm agrupados por data, então basta numerar
+    # as ocorrências de cada hash dentro do dia corrente.
+    day, occurrences = None, {}
+    try:
+        for chunk in chunks:
+            rows = []
+            for row in chunk:
+                if row['data'] != day:
+                    day, occurrences = row['data'], {}
+                centavos = to_cents(row['valor'])
+                row_hash = migrations.expense_hash(row['data'], centavos, row['descricao'])
+                occurrences[row_hash] = occurrences.get(row_hash, 0) + 1
+                rows.append({'username': username, 'descricao': row['descricao'], 'valor_centavos': centavos, 'categoria': row['categoria'],
+                             'data': row['data'], 'hash_importacao': row_hash, 'ocorrencia': occurrences[row_hash]})
+            if not rows:
+                continue
+            with engine.begin() as conn:
+                new_rows = _upsert_rows(conn, 'despesas', columns, ['username', 'hash_importacao', 'ocorrencia'], None, rows,
+                                        returning="data, valor_centavos, categoria").fetchall()
+                _apply_rollup_deltas(conn, username, new_rows)
+            inserted += len(new_rows)
+            duplicates += len(rows) - len(new_rows)
+    except Exception as e:
+        if inserted:
+            cache_utils.invalidate(username, 'despesas')
+        return False, inserted, duplicates, f"Erro ao importar despesas ({inserted} já gravadas; importe o arquivo de novo para completar): {e}"
+    cache_utils.invalidate(username, 'despesas')
+    return True, inserted, duplicates, f"{inserted} despesas importadas, {duplicates} duplicadas ignoradas."
+
 def delete_expense(username, expense_id):
     """Deleta uma despesa específica do usuário."""
-    sql = text("DELETE FROM despesas WHERE id = :id AND username = :user")
+    sql = text("DELETE FROM despesas WHERE id = :id AND username = :user RETURNING data, valor_centavos, categoria")
     engine = get_engine()
     if engine:
-        with engine.connect() as conn:
-            result = conn.execute(sql, {'id': expense_id, 'user': username})
-            conn.commit()
-            return result.rowcount > 0
+        with engine.begin() as conn:
+            deleted = conn.execute(sql, {'id': expense_id, 'user': username}).fetchall()
+            _apply_rollup_deltas(conn, username, deleted, sign=-1)
+        cache_utils.invalidate(username, 'despesas')
+        return len(deleted) > 0
     return False
 
+def update_expense(username, expense_id, descricao, valor, categoria, data, pagador=None, split_p1=None, split_p2=None):
+    """
+    Altera uma despesa do usuário pelo ID (valor em reais), ajustando o resumo mensal (sai o
+    valor antigo do mês/categoria antigos, entra o novo). Retorna (sucesso, mensagem).
+    """
+    engine = get_engine()
+    if not engine:
+        return False, "Falha na conexão."
+    centavos = to_cents(valor)
+    select_sql = text(f"SELECT data, valor_centavos, categoria FROM despesas WHERE id = :id AND username = :user{get_backend().for_update}")
+    update_sql = text("""
+        UPDATE despesas SET descricao = :desc, valor_centavos = :val, categoria = :cat, data = :date,
+               pagador = :payer, split_pessoa1 = :s1, split_pessoa2 = :s2
+        WHERE id = :id AND username = :user
+    """)
+    try:
+        with engine.begin() as conn:
+            old = conn.execute(select_sql, {'id': expense_id, 'user': username}).fetchall()
+            if not old:
+                return False, "Despesa não encontrada."
+            conn.execute(update_sql, {'id': expense_id, 'user': username, 'desc': descricao, 'val': centavos, 'cat': categoria,
+                                      'date': data, 'payer': pagador, 's1': _percent(split_p1), 's2': _percent(split_p2)})
+            _apply_rollup_deltas(conn, username, old, sign=-1)
+            _apply_rollup_deltas(conn, username, [(data, centavos, categoria)])
+        cache_utils.invalidate(username, 'despesas')
+        return True, f"Despesa '{descricao}' atualizada."
+    except Exception as e:
+        return False, f"Erro ao atualizar despesa: {e}"
+
+def _upsert_rows(conn, table, columns, conflict_columns, update_sql, rows, returning=None):
+    """
+    Grava todas as linhas (dicts) com um único INSERT ... ON CONFLICT multi-linha. Com
+    returning, devolve o resultado do RETURNING (só as linhas inseridas ou atualizadas).
+    """
+    sql = get_backend().upsert_sql(table, columns, conflict_columns, update_sql, rows=len(rows))
+    if returning:
+        sql += f" RETURNING {returning}"
+    return conn.execute(text(sql), {f"{c}_{i}": row[c] for i, row in enumerate(rows) for c in columns})
+
 def save_setting(username, key, value):
     """Salva/Atualiza uma configuração usando ON CONFLICT."""
-    sql = text("INSERT INTO app_settings (username, key, value) VALUES (:user, :key, :val) ON CONFLICT (username, key) DO UPDATE SET value = EXCLUDED.value")
+    return save_settings(username, {key: value})
+
+def save_settings(username, settings_dict):
+    """Salva/Atualiza várias configurações num único INSERT ... ON CONFLICT."""
     engine = get_engine()
     if engine:
-        with engine.connect() as conn:
-            conn.execute(sql, {'user': username, 'key': key, 'val': str(value)})
-            conn.commit()
+        if settings_dict:
+            rows = [{'username': username, 'key': key, 'value': str(value)} for key, value in settings_dict.items()]
+            with engine.begin() as conn:
+                _upsert_rows(conn, 'app_settings', ['username', 'key', 'value'], ['username', 'key'], "value = EXCLUDED.value", rows)
+            cache_utils.invalidate(username, 'settings')
         return True
     return False
 
 def save_category_budgets(username, budgets_dict):
-    """Salva/Atualiza múltiplos orçamentos usando ON CONFLICT."""
+    """Salva/Atualiza múltiplos orçamentos (em reais) num único INSERT ... ON CONFLICT."""
     engine = get_engine()
-    sql = text("INSERT INTO orcamentos_categoria (username, categoria, limite) VALUES (:user, :cat, :lim) ON CONFLICT (username, categoria) DO UPDATE SET limite = EXCLUDED.limite")
     if engine:
-        with engine.connect() as conn:
-            for categoria, limite in budgets_dict.items():
-                conn.execute(sql, {'user': username, 'cat': categoria, 'lim': limite})
-            conn.commit()
+        if budgets_dict:
+            rows = [{'username': username, 'categoria': categoria, 'limite_centavos': to_cents(limite)} for categoria, limite in budgets_dict.items()]
+            with engine.begin() as conn:
+                _upsert_rows(conn, 'orcamentos_categoria', ['username', 'categoria', 'limite_centavos'], ['username', 'categoria'], "limite_centavos = EXCLUDED.limite_centavos", rows)
+            cache_utils.invalidate(username, 'budgets')
         return True
-    return False
\ No newline at end of file
+    return False
@@ -0,0 +1,194 @@
+# db_backends.py
+import json
+import os
+import sqlite3
+from datetime import date, datetime
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.pool import StaticPool
+
+# --- BACKENDS DE ARMAZENAMENTO ---
+# O database_utils mantém a mesma API de funções; o que muda entre bancos (DDL, truncamento
+# de datas, upsert, EXPLAIN e criação da engine) fica aqui. O backend é escolhido pela
+# configuração [database] do secrets.toml ou pela variável de ambiente DATABASE_URL:
+#
+#   [database]
+#   backend = "sqlite"                      # ou "postgres" (padrão)
+#   connection_string = "sqlite:///gastos.db"
+
+
+class PostgresBackend:
+    """Backend padrão: servidor Postgres via psycopg2."""
+
+    name = "postgres"
+    id_column = "SERIAL PRIMARY KEY"
+    # Sufixo do SELECT que trava as linhas lidas até o fim da transação.
+    for_update = " FOR UPDATE"
+
+    def create_engine(self, connection_string, pool_options=None):
+        """pool_options: pool_size, max_overflow, pool_pre_ping e pool_recycle do create_engine."""
+        # SQLAlchemy prefere o dialeto 'postgresql+psycopg2'
+        if connection_string.startswith("postgresql://"):
+            connection_string = connection_string.replace("postgresql://", "postgresql+psycopg2://", 1)
+        return create_engine(connection_string, **(pool_options or {}))
+
+    def month_trunc(self, column):
+        """Expressão SQL com o primeiro dia do mês da coluna de data."""
+        return f"CAST(date_trunc('month', {column}) AS DATE)"
+
+    def upsert_sql(self, table, columns, conflict_columns, update_sql, rows=None):
+        """
+        INSERT ... ON CONFLICT ... DO UPDATE. update_sql é a lista de atribuições, que pode
+        referenciar EXCLUDED.<coluna> e <tabela>.<coluna>; sem ela, o conflito vira DO NOTHING.
+        Com rows=N, gera um único INSERT de N linhas cujos parâmetros se chamam :<coluna>_<i>.
+        """
+        if rows is None:
+            values = "(" + ", ".join(f":{c}" for c in columns) + ")"
+        else:
+            values = ", ".join("(" + ", ".join(f":{c}_{i}" for c in columns) + ")" for i in range(rows))
+        return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES {values} "
+                f"ON CONFLICT ({', '.join(conflict_columns)}) " + (f"DO UPDATE SET {update_sql}" if update_sql else "DO NOTHING"))
+
+    def contains_sql(self, column, param):
+        """Filtro 'contém' sem diferenciar maiúsculas; o padrão vem com % e curingas escapados com '\\'."""
+        return f"{column} ILIKE :{param} ESCAPE '\\'"
+
+    def create_trigram_index(self, conn, table, column):
+        """
+        Índice GIN com pg_trgm, que atende ILIKE '%termo%'. Se a extensão não puder ser criada
+        (ex.: usuário sem permissão), a busca continua funcionando sem índice. Retorna se criou.
+        """
+        try:
+            with conn.begin_nested():
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        except DBAPIError:
+            return False
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_{table}_{column}_trgm ON {table} USING gin ({column} gin_trgm_ops)"))
+        return True
+
+    def reset_id_sequence(self, conn, table):
+        """Acerta a sequência do id depois de copiar linhas com id explícito (ex.: tabela recriada)."""
+        conn.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM {table}"))
+
+    def lock_migrations(self, conn):
+        """Serializa migrações entre processos até o fim da transação."""
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('schema_version'))"))
+
+    def uses_index(self, conn, sql, params, table):
+        """
+        Roda EXPLAIN (FORMAT JSON) e retorna (usa_índice, nós do plano). O enable_seqscan é
+        desligado só dentro da transação: assim a verificação mede se o índice *pode* ser
+        usado, independentemente do tamanho atual da tabela.
+        """
+        conn.execute(text("SET LOCAL enable_seqscan = off"))
+        result = conn.execute(text("EXPLAIN (FORMAT JSON) " + sql), params).scalar()
+        if isinstance(result, str):
+            result = json.loads(result)
+        nodes = list(_plan_nodes(result[0]['Plan']))
+        seq_scan = any(n.get('Node Type') == 'Seq Scan' and n.get('Relation Name') == table for n in nodes)
+        return not seq_scan, [n['Node Type'] for n in nodes]
+
+
+class SQLiteBackend(PostgresBackend):
+    """Backend embutido: arquivo SQLite local, sem servidor (instalações domésticas, testes, benchmarks)."""
+
+    name = "sqlite"
+    id_column = "INTEGER PRIMARY KEY AUTOINCREMENT"
+    # O SQLite trava o arquivo inteiro na primeira escrita; não há travamento por linha.
+    for_update = ""
+
+    def create_engine(self, connection_string, pool_options=None):
+        # Datas vão para o SQLite como texto ISO ('AAAA-MM-DD'), que compara na ordem certa, e
+        # voltam (pelo tipo declarado da coluna) como date/datetime, como no Postgres.
+        sqlite3.register_adapter(date, date.isoformat)
+        sqlite3.register_adapter(datetime, datetime.isoformat)
+        sqlite3.register_converter("DATE", _parse_date)
+        sqlite3.register_converter("TIMESTAMP", _parse_timestamp)
+        options = {"connect_args": {"check_same_thread": False, "detect_types": sqlite3.PARSE_DECLTYPES}, **(pool_options or {})}
+        if ":memory:" in connection_string or connection_string.rstrip("/") == "sqlite:":
+            # Banco em memória: uma única conexão compartilhada, senão cada conexão vê um banco vazio.
+            options = {"connect_args": options["connect_args"], "poolclass": StaticPool}
+        engine = create_engine(connection_string, **options)
+
+        @event.listens_for(engine, "connect")
+        def _set_pragmas(dbapi_connection, connection_record):
+            # O pysqlite não abre transação antes de DDL (cada CREATE/DROP seria confirmado na hora);
+            # desligando o controle dele, quem abre a transação é o evento "begin" abaixo.
+            dbapi_connection.isolation_level = None
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.close()
+
+        @event.listens_for(engine, "begin")
+        def _begin(conn):
+            conn.exec_driver_sql("BEGIN")
+
+        return engine
+
+    def month_trunc(self, column):
+        return f"date({column}, 'start of month')"
+
+    def contains_sql(self, column, param):
+        # O LIKE do SQLite já ignora maiúsculas (para ASCII).
+        return f"{column} LIKE :{param} ESCAPE '\\'"
+
+    def create_trigram_index(self, conn, table, column):
+        # Sem pg_trgm: a busca com LIKE '%termo%' varre só as linhas do usuário (índice por username).
+        return False
+
+    def reset_id_sequence(self, conn, table):
+        # O AUTOINCREMENT já guarda o maior id inserido (sqlite_sequence), inclusive os explícitos.
+        pass
+
+    def lock_migrations(self, conn):
+        # Primeiro comando da transação do passo: troca o BEGIN adiado (que só trava o arquivo na
+        # primeira escrita, depois da leitura de current_version) por BEGIN IMMEDIATE, que pega a
+        # trava de escrita já agora. Outro processo espera aqui e depois vê a versão atualizada.
+        conn.exec_driver_sql("ROLLBACK")
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+    def uses_index(self, conn, sql, params, table):
+        """Roda EXPLAIN QUERY PLAN; 'SCAN <tabela>' sem índice indica varredura completa."""
+        rows = conn.execute(text("EXPLAIN QUERY PLAN " + sql), params).fetchall()
+        details = [r[-1] for r in rows]
+        full_scan = any(d.startswith(f"SCAN {table}") and "INDEX" not in d for d in details)
+        return not full_scan, details
+
+
+BACKENDS = {backend.name: backend for backend in (PostgresBackend, SQLiteBackend)}
+
+
+def _parse_date(value):
+    return date.fromisoformat(value.decode()[:10])
+
+
+def _parse_timestamp(value):
+    return datetime.fromisoformat(value.decode())
+
+
+def _plan_nodes(plan):
+    """Percorre recursivamente os nós de um plano do EXPLAIN (FORMAT JSON)."""
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from _plan_nodes(child)
+
+
+def resolve(database_config):
+    """
+    Escolhe (backend, connection_string) a partir da configuração. DATABASE_URL no ambiente
+    tem prioridade; sem 'backend' explícito, o tipo é deduzido do esquema da URL.
+    """
+    env_url = os.environ.get("DATABASE_URL")
+    if env_url:
+        connection_string, backend_name = env_url, os.environ.get("DATABASE_BACKEND")
+    else:
+        connection_string, backend_name = database_config.get("connection_string"), database_config.get("backend")
+    if not connection_string:
+        raise ValueError("Configure [database] connection_string no secrets.toml ou DATABASE_URL.")
+    if not backend_name:
+        backend_name = "sqlite" if connection_string.startswith("sqlite") else "postgres"
+    if backend_name not in BACKENDS:
+        raise ValueError(f"Backend de banco desconhecido: {backend_name}")
+    return BACKENDS[backend_name](), connection_string
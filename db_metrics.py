@@ -0,0 +1,81 @@
+# db_metrics.py
+import logging
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+from sqlalchemy import event
+
+# --- INSTRUMENTAÇÃO DAS CONSULTAS ---
+# Eventos do SQLAlchemy medem cada statement: latência, linhas afetadas e a função do
+# database_utils que o disparou. As medições ficam numa lista por thread (cada execução do
+# script Streamlit roda na thread da sessão), zerada por start_rerun(), e num agregado por
+# ponto de chamada para o processo inteiro.
+
+DEFAULT_SLOW_QUERY_MS = 200
+
+logger = logging.getLogger("database_utils")
+
+_local = threading.local()
+_totals = defaultdict(lambda: {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+_totals_lock = threading.Lock()
+_INSTRUMENTED_FILE = "database_utils.py"
+
+
+def _call_site():
+    """Primeira função do database_utils na pilha (ex.: 'get_monthly_expenses:142')."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        if os.path.basename(frame.f_code.co_filename) == _INSTRUMENTED_FILE:
+            return f"{frame.f_code.co_name}:{frame.f_lineno}"
+        frame = frame.f_back
+    return "?"
+
+
+def instrument(engine, slow_query_ms=DEFAULT_SLOW_QUERY_MS):
+    """Registra os listeners de tempo na engine. Consultas acima de slow_query_ms vão para o log."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append((time.perf_counter(), _call_site()))
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        start, site = conn.info["query_start"].pop()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        rows = cursor.rowcount if cursor.rowcount is not None and cursor.rowcount >= 0 else None
+        _record(site, " ".join(statement.split()), elapsed_ms, rows)
+        if elapsed_ms >= slow_query_ms:
+            logger.warning("Consulta lenta (%.0f ms) em %s: %s", elapsed_ms, site, " ".join(statement.split())[:300])
+
+    return engine
+
+
+def _record(site, statement, elapsed_ms, rows):
+    records = getattr(_local, "records", None)
+    if records is not None:
+        records.append({"site": site, "statement": statement, "ms": elapsed_ms, "rows": rows})
+    with _totals_lock:
+        total = _totals[site]
+        total["count"] += 1
+        total["total_ms"] += elapsed_ms
+        total["max_ms"] = max(total["max_ms"], elapsed_ms)
+
+
+def start_rerun():
+    """Zera as medições da thread atual; chamar no início de cada execução do script."""
+    _local.records = []
+
+
+def rerun_summary():
+    """Retorna {'count', 'total_ms', 'records'} das consultas desde o último start_rerun()."""
+    records = list(getattr(_local, "records", None) or [])
+    return {"count": len(records), "total_ms": sum(r["ms"] for r in records), "records": records}
+
+
+def totals_by_site():
+    """Agregado do processo: {ponto_de_chamada: {'count', 'total_ms', 'max_ms'}}."""
+    with _totals_lock:
+        return {site: dict(values) for site, values in _totals.items()}
@@ -0,0 +1,82 @@
+# export_utils.py
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import database_utils
+
+# --- EXPORTAÇÕES EM SEGUNDO PLANO ---
+# Cada exportação roda num pool de threads próprio e grava num arquivo temporário via
+# database_utils.export_expenses, sem ocupar a execução do script de ninguém: a interface só
+# consulta o estado do job até o arquivo ficar pronto para download. Arquivos de jobs antigos
+# são apagados depois de JOB_TTL_SECONDS.
+
+MAX_CONCURRENT_EXPORTS = 2
+JOB_TTL_SECONDS = 3600
+CONTENT_TYPES = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+
+_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_EXPORTS, thread_name_prefix="export")
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def _run(job_id, username, start_date, end_date, file_format):
+    job = _jobs[job_id]
+    job['status'] = 'running'
+
+    def progress(rows):
+        job['rows'] = rows
+
+    try:
+        job['rows'] = database_utils.export_expenses(username, start_date, end_date, file_format, job['path'], progress=progress)
+        job['status'] = 'done'
+    except Exception as e:
+        job['status'], job['error'] = 'error', str(e)
+    job['finished_at'] = time.time()
+
+
+def _cleanup_expired():
+    now = time.time()
+    with _jobs_lock:
+        expired = [job_id for job_id, job in _jobs.items() if job['finished_at'] and now - job['finished_at'] > JOB_TTL_SECONDS]
+    for job_id in expired:
+        discard(job_id)
+
+
+def start_export(username, start_date, end_date, file_format):
+    """Agenda a exportação de [start_date, end_date) e retorna o id do job."""
+    if file_format not in CONTENT_TYPES:
+        raise ValueError(f"Formato de exportação desconhecido: {file_format}")
+    _cleanup_expired()
+    handle, path = tempfile.mkstemp(prefix="despesas-", suffix=f".{file_format}")
+    os.close(handle)
+    job_id = uuid.uuid4().hex
+    with _jobs_lock:
+        _jobs[job_id] = {
+            'username': username, 'format': file_format, 'path': path, 'status': 'queued',
+            'rows': 0, 'error': None, 'finished_at': None,
+            'filename': f"despesas_{start_date:%Y%m%d}_{end_date - timedelta(days=1):%Y%m%d}.{file_format}",
+        }
+    _executor.submit(_run, job_id, username, start_date, end_date, file_format)
+    return job_id
+
+
+def get_job(job_id, username):
+    """Estado do job ('queued', 'running', 'done' ou 'error'), só para o dono; None se não existir."""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is None or job['username'] != username:
+            return None
+        return dict(job)
+
+
+def discard(job_id):
+    """Esquece o job e apaga o arquivo temporário."""
+    with _jobs_lock:
+        job = _jobs.pop(job_id, None)
+    if job and os.path.exists(job['path']):
+        os.remove(job['path'])
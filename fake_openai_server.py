@@ -0,0 +1,178 @@
+# fake_openai_server.py
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- SERVIDOR OPENAI FALSO PARA TESTES ---
+# Implementa, com respostas determinísticas, os endpoints que o app usa:
+#   POST /v1/chat/completions      (extração de despesa, categorização em lote e texto livre,
+#                                   com ou sem stream)
+#   POST /v1/audio/transcriptions  (devolve sempre o mesmo texto configurado)
+# Uso: python fake_openai_server.py --port 8765 e, no secrets.toml,
+#
+#   [llm]
+#   base_url = "http://127.0.0.1:8765/v1"
+#
+# --latency-ms simula a latência da API e --fail-every N responde 429 a cada N requisições
+# (com Retry-After: 0), para exercitar o backoff do llm_gateway.
+
+DEFAULT_TRANSCRIPT = "mercado 42,50"
+
+_USER_TEXT_RE = re.compile(r'Texto do usuário: "(.*)"', re.DOTALL)
+_CATEGORIES_RE = re.compile(r"seguintes categorias: ([^\n]*?)\.\s*$", re.MULTILINE)
+_ITEM_RE = re.compile(r"^\s*\d+\. (.*)$", re.MULTILINE)
+_AMOUNT_RE = re.compile(r"\d+(?:[.,]\d{1,2})?")
+
+
+def _match_category(text, categories):
+    lowered = text.lower()
+    for category in categories:
+        if category.lower() in lowered:
+            return category
+    return "Outros" if "Outros" in categories or not categories else categories[0]
+
+
+def _expense_reply(prompt):
+    user_text = _USER_TEXT_RE.search(prompt).group(1)
+    categories_match = _CATEGORIES_RE.search(prompt)
+    categories = [c.strip() for c in categories_match.group(1).split(",")] if categories_match else []
+    amount = _AMOUNT_RE.search(user_text)
+    if not amount:
+        return {"not_expense": True}
+    description = (user_text[:amount.start()] + user_text[amount.end():]).replace("R$", "").strip(" ,.-") or user_text
+    return {
+        "descricao": description,
+        "valor": float(amount.group(0).replace(",", ".")),
+        "categoria": _match_category(user_text, categories),
+    }
+
+
+def _batch_reply(prompt):
+    categories_match = _CATEGORIES_RE.search(prompt)
+    categories = [c.strip() for c in categories_match.group(1).split(",")] if categories_match else []
+    items = _ITEM_RE.findall(prompt.split("Lançamentos:", 1)[1])
+    return {"categorias": [_match_category(item, categories) for item in items]}
+
+
+def completion_content(body):
+    """Resposta determinística para o corpo de um chat completion."""
+    prompt = "\n".join(str(m.get("content", "")) for m in body.get("messages", []))
+    if (body.get("response_format") or {}).get("type") == "json_object":
+        if _USER_TEXT_RE.search(prompt):
+            return json.dumps(_expense_reply(prompt), ensure_ascii=False)
+        if "Lançamentos:" in prompt:
+            return json.dumps(_batch_reply(prompt), ensure_ascii=False)
+        return "{}"
+    digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+    return f"1. Revise os gastos das categorias acima do orçamento.\n2. Defina um limite semanal.\n(resposta simulada {digest})"
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, count, model, content, usage):
+        """Server-sent events no formato chat.completion.chunk, um pedaço por palavra."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        base = {"id": f"chatcmpl-fake-{count}", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+        pieces = re.findall(r"\S+\s*|\s+", content)
+        for piece in pieces:
+            chunk = {**base, "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+        events = [{**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}]
+        if usage:
+            prompt_tokens, completion_tokens = usage
+            events.append({**base, "choices": [], "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                                                            "total_tokens": prompt_tokens + completion_tokens}})
+        for event in events:
+            self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with server.lock:
+            server.request_count += 1
+            count = server.request_count
+        if server.latency_ms:
+            time.sleep(server.latency_ms / 1000)
+        if server.fail_every and count % server.fail_every == 0:
+            self._send_json(429, {"error": {"message": "Rate limit simulado", "type": "rate_limit_error"}},
+                            {"Retry-After": "0"})
+            return
+
+        if self.path.endswith("/chat/completions"):
+            request = json.loads(body or b"{}")
+            content = completion_content(request)
+            prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in request.get("messages", []))
+            completion_tokens = len(content.split())
+            if request.get("stream"):
+                include_usage = (request.get("stream_options") or {}).get("include_usage")
+                self._send_stream(count, request.get("model", "fake"), content,
+                                  (prompt_tokens, completion_tokens) if include_usage else None)
+                return
+            self._send_json(200, {
+                "id": f"chatcmpl-fake-{count}", "object": "chat.completion", "created": int(time.time()),
+                "model": request.get("model", "fake"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                          "total_tokens": prompt_tokens + completion_tokens},
+            })
+        elif self.path.endswith("/audio/transcriptions"):
+            self._send_json(200, {"text": server.transcript})
+        else:
+            self._send_json(404, {"error": {"message": f"Rota desconhecida: {self.path}"}})
+
+
+def start(host="127.0.0.1", port=0, latency_ms=0, fail_every=0, transcript=DEFAULT_TRANSCRIPT):
+    """
+    Sobe o servidor numa thread daemon e retorna (servidor, base_url). port=0 escolhe uma
+    porta livre. server.request_count conta as requisições recebidas; server.shutdown() encerra.
+    """
+    server = ThreadingHTTPServer((host, port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.request_count = 0
+    server.latency_ms = latency_ms
+    server.fail_every = fail_every
+    server.transcript = transcript
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor OpenAI falso e determinístico para testes locais.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=int, default=0)
+    parser.add_argument("--fail-every", type=int, default=0)
+    parser.add_argument("--transcript", default=DEFAULT_TRANSCRIPT)
+    args = parser.parse_args(argv)
+    server, base_url = start(args.host, args.port, args.latency_ms, args.fail_every, args.transcript)
+    print(f"Servidor OpenAI falso em {base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,172 @@
+# import_utils.py
+import csv
+import io
+import re
+from datetime import datetime
+from itertools import islice
+
+import database_utils
+import parser_utils
+
+# --- IMPORTAÇÃO DE EXTRATOS (CSV/OFX) ---
+# O arquivo é lido como um fluxo: as linhas viram lotes de DEFAULT_CHUNK_SIZE despesas, que
+# são categorizados e gravados um de cada vez, cada lote na sua transação. Assim o uso de
+# memória não cresce com o tamanho do extrato.
+
+DEFAULT_CHUNK_SIZE = 500
+_READ_BLOCK_SIZE = 64 * 1024
+_DATE_FORMATS = ("%d/%m/%Y", "%Y-%m-%d", "%d/%m/%y", "%d-%m-%Y", "%Y%m%d")
+
+
+def parse_money(value):
+    """Converte '-1.234,56', 'R$ 50,00', '1234.56' ou '-50' em float (None se inválido)."""
+    value = re.sub(r"[^\d,.\-]", "", str(value))
+    if not re.search(r"\d", value):
+        return None
+    if "," in value and "." in value:
+        # O separador que aparece por último é o decimal.
+        if value.rfind(",") > value.rfind("."):
+            value = value.replace(".", "").replace(",", ".")
+        else:
+            value = value.replace(",", "")
+    elif "," in value:
+        value = value.replace(",", ".")
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def parse_date(value):
+    """Converte as datas mais comuns de extratos brasileiros (e do OFX) em date."""
+    value = str(value).strip()
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(value[:len(datetime(2000, 12, 31).strftime(fmt))], fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _text_stream(file):
+    """Abre o arquivo enviado como texto, testando UTF-8 e caindo para Latin-1."""
+    sample = file.read(_READ_BLOCK_SIZE)
+    file.seek(0)
+    try:
+        sample.decode("utf-8-sig")
+        encoding = "utf-8-sig"
+    except UnicodeDecodeError:
+        encoding = "latin-1"
+    return io.TextIOWrapper(file, encoding=encoding, newline="")
+
+
+def _find_column(header, *keywords, exclude=()):
+    for i, name in enumerate(header):
+        normalized = parser_utils.normalize(name).strip()
+        if i not in exclude and any(k in normalized for k in keywords):
+            return i
+    return None
+
+
+def iter_csv_rows(file):
+    """Gera (data, descrição, valor) a partir de um CSV de banco, linha a linha."""
+    stream = _text_stream(file)
+    try:
+        sample = stream.read(_READ_BLOCK_SIZE)
+        stream.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.reader(stream, dialect)
+        header = next(reader, None)
+        if not header:
+            return
+        date_col = _find_column(header, "data", "date", "dt")
+        amount_col = _find_column(header, "valor", "amount", "quantia")
+        desc_col = _find_column(header, "descri", "histor", "title", "memo", "lancamento", "estabelecimento", exclude=(date_col, amount_col))
+        if None in (date_col, amount_col, desc_col):
+            raise ValueError("O CSV precisa ter colunas de data, descrição e valor.")
+        for row in reader:
+            if len(row) <= max(date_col, amount_col, desc_col):
+                continue
+            yield parse_date(row[date_col]), row[desc_col].strip(), parse_money(row[amount_col])
+    finally:
+        stream.detach()
+
+
+_OFX_BLOCK_RE = re.compile(r"<STMTTRN>(.*?)</STMTTRN>", re.IGNORECASE | re.DOTALL)
+_OFX_FIELD_RE = re.compile(r"<(DTPOSTED|TRNAMT|MEMO|NAME)>([^<\r\n]*)", re.IGNORECASE)
+
+
+def iter_ofx_rows(file):
+    """
+    Gera (data, descrição, valor) a partir de um OFX (SGML ou XML). O arquivo é lido em
+    blocos e só as transações completas (<STMTTRN>...</STMTTRN>) são processadas.
+    """
+    stream = _text_stream(file)
+    try:
+        buffer = ""
+        while True:
+            block = stream.read(_READ_BLOCK_SIZE)
+            buffer += block
+            last_end = 0
+            for match in _OFX_BLOCK_RE.finditer(buffer):
+                fields = {k.upper(): v.strip() for k, v in _OFX_FIELD_RE.findall(match.group(1))}
+                description = fields.get("MEMO") or fields.get("NAME") or ""
+                yield parse_date(fields.get("DTPOSTED", "")[:8]), description, parse_money(fields.get("TRNAMT", ""))
+                last_end = match.end()
+            buffer = buffer[last_end:]
+            if not block:
+                break
+    finally:
+        stream.detach()
+
+
+def _chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def import_statement(username, file, file_format, categories, expense_sign="negative", chunk_size=DEFAULT_CHUNK_SIZE,
+                     llm_categorize=None, threshold=parser_utils.DEFAULT_CONFIDENCE_THRESHOLD):
+    """
+    Importa um extrato CSV ou OFX mantendo as datas originais.
+
+    expense_sign indica como as despesas aparecem no arquivo: 'negative' (extrato de conta)
+    ou 'positive' (fatura de cartão); lançamentos do sinal oposto são ignorados. As categorias
+    vêm do classificador local do usuário; se llm_categorize(descrições, categorias) for
+    informado, as descrições de baixa confiança de cada lote são enviadas numa única chamada.
+    Retorna um dict com 'success', 'inserted', 'duplicates', 'skipped' e 'message'.
+    """
+    rows = iter_ofx_rows(file) if file_format == "ofx" else iter_csv_rows(file)
+    model = parser_utils.get_user_classifier(username, categories)
+    skipped = 0
+
+    def expenses():
+        nonlocal skipped
+        for data, descricao, valor in rows:
+            if data is None or valor is None or not descricao:
+                skipped += 1
+                continue
+            if (valor < 0) != (expense_sign == "negative") or valor == 0:
+                continue
+            yield {"data": data, "descricao": descricao, "valor": abs(valor)}
+
+    def categorized(chunk):
+        uncertain = []
+        for i, row in enumerate(chunk):
+            row["categoria"], confidence = parser_utils.classify(row["descricao"], model)
+            if confidence < threshold:
+                uncertain.append(i)
+        if llm_categorize and uncertain:
+            llm_categories = llm_categorize([chunk[i]["descricao"] for i in uncertain], categories)
+            if llm_categories:
+                for i, category in zip(uncertain, llm_categories):
+                    chunk[i]["categoria"] = category
+        return chunk
+
+    chunks = (categorized(chunk) for chunk in _chunked(expenses(), chunk_size))
+    success, inserted, duplicates, message = database_utils.import_expense_chunks(username, chunks)
+    return {"success": success, "inserted": inserted, "duplicates": duplicates, "skipped": skipped, "message": message}
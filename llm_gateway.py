@@ -0,0 +1,301 @@
+# llm_gateway.py
+import hashlib
+import json
+import random
+import sqlite3
+import threading
+import time
+
+import openai
+
+# --- GATEWAY DAS CHAMADAS À OPENAI ---
+# Toda chamada ao modelo passa por aqui:
+#   * cache persistente (SQLite local) pela chave (modelo, versão do template, entrada
+#     normalizada, categorias), com descarte das entradas menos usadas acima do limite;
+#   * single-flight: pedidos idênticos em andamento esperam a primeira resposta;
+#   * limite de requisições por minuto no cliente e backoff exponencial para 429/5xx;
+#   * registro por usuário de tokens e latência.
+# O base_url é configurável, o que permite apontar para o fake_openai_server.py nos testes.
+
+DEFAULT_CACHE_PATH = ".llm_cache.sqlite"
+DEFAULT_CACHE_MAX_ENTRIES = 5000
+DEFAULT_REQUESTS_PER_MINUTE = 60
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BURST = 5
+
+# Erros transitórios que valem nova tentativa (APITimeoutError herda de APIConnectionError).
+_RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+def normalize_input(text):
+    """Minúsculas e espaços colapsados: 'Aluguel  2500' e 'aluguel 2500' caem na mesma chave."""
+    return " ".join(str(text).lower().split())
+
+
+def cache_key(model, template_version, normalized_input, categories=()):
+    payload = json.dumps([model, template_version, normalized_input, sorted(categories or ())], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class GatewayStore:
+    """Arquivo SQLite com o cache de respostas e o histórico de uso por usuário."""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            key TEXT PRIMARY KEY, model TEXT NOT NULL, template_version TEXT NOT NULL,
+            content TEXT NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL
+        )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache (last_used)")
+        self._conn.execute("""
+        CREATE TABLE IF NOT EXISTS llm_usage (
+            username TEXT, purpose TEXT NOT NULL, model TEXT NOT NULL,
+            prompt_tokens INTEGER NOT NULL, completion_tokens INTEGER NOT NULL,
+            latency_ms REAL NOT NULL, cached INTEGER NOT NULL, created_at REAL NOT NULL
+        )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_usage_username ON llm_usage (username)")
+
+    def get(self, key):
+        """Retorna o conteúdo guardado (marcando o uso) ou None."""
+        with self._lock:
+            row = self._conn.execute("SELECT content FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def put(self, key, model, template_version, content):
+        """Grava a resposta e descarta as entradas usadas há mais tempo acima de max_entries."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, model, template_version, content, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (key, model, template_version, content, now, now)
+            )
+            excess = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self._conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_used LIMIT ?)", (excess,)
+                )
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+    def record_usage(self, username, purpose, model, prompt_tokens, completion_tokens, latency_ms, cached):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO llm_usage (username, purpose, model, prompt_tokens, completion_tokens, latency_ms, cached, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (username, purpose, model, prompt_tokens, completion_tokens, latency_ms, int(cached), time.time())
+            )
+
+    def usage_summary(self, username=None):
+        """
+        Totais de uso (do usuário, ou de todos com username=None): chamadas, respostas do
+        cache, tokens e latência média das chamadas que foram de fato à API.
+        """
+        where, params = ("WHERE username = ?", (username,)) if username is not None else ("", ())
+        with self._lock:
+            row = self._conn.execute(f"""
+            SELECT COUNT(*), COALESCE(SUM(cached), 0), COALESCE(SUM(prompt_tokens), 0),
+                   COALESCE(SUM(completion_tokens), 0), AVG(CASE WHEN cached = 0 THEN latency_ms END)
+            FROM llm_usage {where}
+            """, params).fetchone()
+        calls, cached, prompt_tokens, completion_tokens, avg_latency = row
+        return {
+            "calls": calls, "cache_hits": cached,
+            "hit_rate": cached / calls if calls else 0.0,
+            "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "avg_latency_ms": avg_latency or 0.0,
+        }
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce chamadas simultâneas com a mesma chave numa única execução."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """Retorna (resultado, compartilhado). Quem chega com a chave em andamento espera o resultado."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+
+class RateLimiter:
+    """Token bucket de requests_per_minute com rajada de até burst chamadas (None ou 0 desliga o limite)."""
+
+    def __init__(self, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, burst=DEFAULT_BURST):
+        self.rate = requests_per_minute / 60.0 if requests_per_minute else None
+        self.capacity = float(max(1, burst))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate is None:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def _retry_after(error):
+    """Segundos pedidos pelo servidor no cabeçalho Retry-After, se houver."""
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class LLMGateway:
+    def __init__(self, api_key=None, base_url=None, cache_path=DEFAULT_CACHE_PATH,
+                 cache_max_entries=DEFAULT_CACHE_MAX_ENTRIES, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+                 max_retries=DEFAULT_MAX_RETRIES):
+        # As novas tentativas ficam com o gateway (que respeita o limite local), não com o SDK.
+        self.client = openai.OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+        self.store = GatewayStore(cache_path, cache_max_entries)
+        self.limiter = RateLimiter(requests_per_minute)
+        self.max_retries = max_retries
+        self._flights = SingleFlight()
+
+    def _with_backoff(self, request):
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            try:
+                return request()
+            except _RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = _retry_after(e)
+                if delay is None:
+                    delay = 0.5 * 2 ** attempt
+                    delay += random.uniform(0, delay / 4)
+                time.sleep(delay)
+
+    def _cached_call(self, key, model, template_version, username, purpose, request, parse, cache):
+        if cache:
+            content = self.store.get(key)
+            if content is not None:
+                self.store.record_usage(username, purpose, model, 0, 0, 0.0, cached=True)
+                return parse(content) if parse else content
+
+        def run():
+            start = time.perf_counter()
+            content, prompt_tokens, completion_tokens = self._with_backoff(request)
+            latency_ms = (time.perf_counter() - start) * 1000
+            self.store.record_usage(username, purpose, model, prompt_tokens, completion_tokens, latency_ms, cached=False)
+            # Só guarda respostas que o chamador consegue usar; um JSON inválido não fica preso no cache.
+            if parse:
+                parse(content)
+            if cache and content:
+                self.store.put(key, model, template_version, content)
+            return content
+
+        content, shared = self._flights.do(key, run)
+        if shared:
+            self.store.record_usage(username, purpose, model, 0, 0, 0.0, cached=True)
+        # Cada chamador recebe seu próprio objeto, mesmo quando a resposta foi compartilhada.
+        return parse(content) if parse else content
+
+    def chat(self, messages, *, model, template_version, cache_input, categories=(), username=None,
+             purpose="chat", parse=None, cache=True, **params):
+        """
+        Chat completion pelo gateway. cache_input é o texto variável do prompt (normalizado para
+        a chave); template_version deve mudar sempre que o texto fixo do prompt mudar. Com parse,
+        retorna parse(conteúdo) e só grava no cache se o parse der certo.
+        """
+        key = cache_key(model, template_version, normalize_input(cache_input), categories)
+
+        def request():
+            response = self.client.chat.completions.create(model=model, messages=messages, **params)
+            usage = response.usage
+            return (response.choices[0].message.content,
+                    getattr(usage, "prompt_tokens", 0) or 0, getattr(usage, "completion_tokens", 0) or 0)
+
+        return self._cached_call(key, model, template_version, username, purpose, request, parse, cache)
+
+    def chat_stream(self, messages, *, model, template_version, cache_input, categories=(), username=None,
+                    purpose="chat", cache=True, **params):
+        """
+        Versão em streaming de chat(): gera os pedaços de texto conforme chegam. Uma resposta
+        já em cache sai inteira, num único pedaço; a resposta completa só é gravada no fim.
+        """
+        key = cache_key(model, template_version, normalize_input(cache_input), categories)
+        if cache:
+            content = self.store.get(key)
+            if content is not None:
+                self.store.record_usage(username, purpose, model, 0, 0, 0.0, cached=True)
+                yield content
+                return
+
+        start = time.perf_counter()
+        stream = self._with_backoff(lambda: self.client.chat.completions.create(
+            model=model, messages=messages, stream=True, stream_options={"include_usage": True}, **params
+        ))
+        parts, usage = [], None
+        for chunk in stream:
+            if chunk.usage is not None:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+        latency_ms = (time.perf_counter() - start) * 1000
+        self.store.record_usage(username, purpose, model, getattr(usage, "prompt_tokens", 0) or 0,
+                                getattr(usage, "completion_tokens", 0) or 0, latency_ms, cached=False)
+        if cache and parts:
+            self.store.put(key, model, template_version, "".join(parts))
+
+    def transcribe(self, audio_bytes, *, model="whisper-1", template_version="transcricao-v1", username=None,
+                   filename="audio.wav"):
+        """Transcrição pelo gateway; a chave usa o hash do áudio."""
+        key = cache_key(model, template_version, hashlib.sha256(audio_bytes).hexdigest())
+
+        def request():
+            transcript = self.client.audio.transcriptions.create(model=model, file=(filename, audio_bytes))
+            return transcript.text, 0, 0
+
+        return self._cached_call(key, model, template_version, username, "transcricao", request, None, True)
+
+    def usage_summary(self, username=None):
+        return self.store.usage_summary(username)
@@ -1,41 +1,44 @@
+import functools
 import streamlit as st
-from datetime import datetime
+from datetime import datetime, date, timedelta
 import pandas as pd
 import plotly.express as px
-import plotly.graph_objects as go
 import streamlit_authenticator as stauth
 from streamlit_authenticator.utilities.hasher import Hasher
 
 # Utilitários locais
+import advice_utils
+import auth_utils
+import chart_utils
 import database_utils
+import db_metrics
+import export_utils
+import import_utils
 import openai_utils
+import parser_utils
+import settlement_utils
+import voice_utils
 
 # --- CONFIGURAÇÃO DA PÁGINA E INICIALIZAÇÃO DO BANCO ---
 st.set_page_config(page_title="Agente Financeiro", layout="wide")
+db_metrics.start_rerun()
 CATEGORIES = ["Diversão", "Alguel/Condomínio", "Carro", "Supermercado", "Limpeza", "Marmitas","Investimento", "Saúde","Luz/Internet","Outros"]
+PARSER_CONFIDENCE_THRESHOLD = float(st.secrets.get("parser", {}).get("confidence_threshold", parser_utils.DEFAULT_CONFIDENCE_THRESHOLD))
+TRANSCRIPTION_CONFIG = st.secrets.get("transcription", {})
+TRANSCRIPTION_BACKEND = TRANSCRIPTION_CONFIG.get("backend", "openai")
+if TRANSCRIPTION_BACKEND == "local":
+    # Substituto offline do Whisper para testes (ver voice_utils.LocalTranscriber).
+    voice_utils.register_backend("local", voice_utils.LocalTranscriber(default_text=TRANSCRIPTION_CONFIG.get("local_text")))
 database_utils.init_db() 
 
-# --- FUNÇÃO OTIMIZADA PARA CARREGAR CREDENCIAIS COM CACHE ---
-@st.cache_data
-def load_credentials():
-    users = database_utils.fetch_all_users()
-    credentials = {
-        "usernames": {
-            user['username']: { "name": user['name'], "email": user['email'], "password": user['hashed_password'] }
-            for user in users
-        }
-    }
-    return credentials
-
-credentials = load_credentials()
-
-# --- LÓGICA DE AUTENTICAÇÃO (FORA DO CACHE) ---
-authenticator = stauth.Authenticate(
-    credentials,
+# --- LÓGICA DE AUTENTICAÇÃO ---
+# As credenciais não são carregadas em massa: auth_utils busca só o usuário que está entrando.
+authenticator = auth_utils.attach(stauth.Authenticate(
+    {"usernames": {}},
     st.secrets.get("cookie", {}).get("name", "some_cookie_name"),
     st.secrets.get("cookie", {}).get("key", "some_random_key"),
     st.secrets.get("cookie", {}).get("expiry_days", 30)
-)
+))
 
 # --- TELA DE LOGIN / REGISTRO ---
 if not st.session_state.get("authentication_status"):
@@ -70,7 +73,6 @@ if not st.session_state.get("authentication_status"):
                         hashed_password = Hasher([password]).generate()[0]
                         success, message = database_utils.add_user(username_reg, name, email, hashed_password)
                         if success:
-                            st.cache_data.clear()
                             st.success(message)
                             st.info("Por favor, faça o login com suas novas credenciais.")
                         else:
@@ -92,10 +94,21 @@ if st.session_state["authentication_status"]:
         if "messages" not in st.session_state: st.session_state.messages = []
         st.session_state.messages.append({"role": "user", "content": prompt_text})
         with st.spinner("Analisando..."):
-            analysis = openai_utils.analyze_expense_text(prompt_text, CATEGORIES)
-            if "descricao" in analysis and "valor" in analysis:
-                st.session_state.pending_expense = {"descricao": analysis['descricao'], "valor": float(analysis['valor']), "categoria": analysis.get('categoria', 'Outros')}
-                st.session_state.messages.append({"role": "assistant", "content": "Ótimo! Preencha os detalhes do pagamento ao lado."})
+            # No modo de vários gastos, cada trecho com valor vira uma despesa candidata.
+            segments = parser_utils.split_message(prompt_text) if st.session_state.get("multi_expense_mode") else [prompt_text]
+            # Parser local primeiro; a OpenAI só entra (em paralelo) quando a confiança fica abaixo do limite.
+            llm_analyze = functools.partial(openai_utils.analyze_expense_with_retry, username=user)
+            analyses = parser_utils.analyze_batch(segments, CATEGORIES, user, llm_analyze, PARSER_CONFIDENCE_THRESHOLD)
+            items = [
+                {"descricao": a['descricao'], "valor": float(a['valor']), "categoria": a.get('categoria', 'Outros')}
+                for a in analyses if "descricao" in a and "valor" in a
+            ]
+            if items:
+                st.session_state.pending_expenses = items
+                reply = "Ótimo! Preencha os detalhes do pagamento ao lado." if len(items) == 1 else f"Encontrei {len(items)} despesas. Confira os detalhes ao lado."
+                if len(items) < len(segments):
+                    reply += f" ({len(segments) - len(items)} trecho(s) não reconhecido(s).)"
+                st.session_state.messages.append({"role": "assistant", "content": reply})
             else:
                 st.session_state.messages.append({"role": "assistant", "content": "Não consegui processar. Tente de novo."})
         st.rerun()
@@ -104,23 +117,24 @@ if st.session_state["authentication_status"]:
         authenticator.logout('Logout', 'main')
         st.divider()
         st.header("Modo de Uso")
-        saved_app_mode = database_utils.load_setting(username, 'app_mode', 'Individual')
+        # Configurações e orçamentos chegam numa única consulta (e num único item de cache).
+        user_context = database_utils.load_user_context(username, CATEGORIES)
+        user_settings = user_context['settings']
+        saved_app_mode = user_settings.get('app_mode', 'Individual')
         app_mode_index = 0 if saved_app_mode == 'Individual' else 1
         app_mode = st.radio("Selecione:", ("Individual", "Casal"), index=app_mode_index, horizontal=True)
         if app_mode != saved_app_mode:
             database_utils.save_setting(username, 'app_mode', app_mode)
-            st.cache_data.clear()
+        st.toggle("Vários gastos por mensagem", key="multi_expense_mode", help='Ex.: "uber 23, padaria 12 e farmácia 48"')
 
         if app_mode == "Casal":
             st.subheader("Nomes do Casal")
-            p1 = database_utils.load_setting(username, 'person1_name', 'Pessoa 1')
-            p2 = database_utils.load_setting(username, 'person2_name', 'Pessoa 2')
+            p1 = user_settings.get('person1_name', 'Pessoa 1')
+            p2 = user_settings.get('person2_name', 'Pessoa 2')
             person1_name = st.text_input("Pessoa 1", value=p1)
             person2_name = st.text_input("Pessoa 2", value=p2)
             if st.button("Salvar Nomes", use_container_width=True):
-                database_utils.save_setting(username, 'person1_name', person1_name)
-                database_utils.save_setting(username, 'person2_name', person2_name)
-                st.cache_data.clear()
+                database_utils.save_settings(username, {'person1_name': person1_name, 'person2_name': person2_name})
                 st.success("Nomes salvos!")
         else:
             person1_name, person2_name = "Eu", ""
@@ -128,16 +142,342 @@ if st.session_state["authentication_status"]:
         st.divider()
         st.header("Orçamentos")
         with st.expander("Definir por Categoria", expanded=False):
-            saved_budgets = database_utils.load_category_budgets(username, CATEGORIES)
+            saved_budgets = user_context['budgets']
             category_budgets = {}
             for category in CATEGORIES:
                 category_budgets[category] = st.number_input(f"{category}", value=saved_budgets.get(category, 0.0), key=f"budget_{category}")
             if st.button("Salvar Limites", use_container_width=True, type="primary"):
                 database_utils.save_category_budgets(username, category_budgets)
-                st.cache_data.clear()
                 st.success("Limites salvos!")
 
-    tab1, tab2 = st.tabs(["💬 Registro", "📊 Análise"])
+        st.divider()
+        with st.expander("Desempenho do Registro", expanded=False):
+            llm_usage = openai_utils.gateway.usage_summary(username)
+            if llm_usage['calls']:
+                st.caption(
+                    f"OpenAI (seu uso): {llm_usage['calls']} pedidos, {llm_usage['hit_rate']:.0%} do cache, "
+                    f"{llm_usage['prompt_tokens'] + llm_usage['completion_tokens']} tokens, "
+                    f"média de {llm_usage['avg_latency_ms']:.0f} ms"
+                )
+            else:
+                st.caption("OpenAI (seu uso): nenhum pedido ainda.")
+
+    tab1, tab2, tab3, tab4 = st.tabs(["💬 Registro", "📊 Análise", "📈 Tendências", "🗂️ Histórico"])
+
+    # --- FRAGMENTOS: cada painel reroda sozinho quando só os seus widgets mudam ---
+    # Ações que alteram dados (salvar, deletar, novo gasto) chamam st.rerun(), que reroda o app inteiro.
+
+    @st.fragment
+    def painel_registro():
+        st.subheader("Ação Necessária")
+        if st.session_state.get('pending_expenses'):
+            items = st.session_state.pending_expenses
+            with st.container(border=True):
+                if len(items) == 1:
+                    st.info(f"Despesa: **{items[0]['descricao']}** - **R${items[0]['valor']:.2f}**")
+                else:
+                    st.info(f"**{len(items)} despesas** - total **R${sum(item['valor'] for item in items):.2f}**")
+                    st.dataframe(
+                        pd.DataFrame(items).rename(columns={'descricao': 'Descrição', 'valor': 'Valor', 'categoria': 'Categoria'}),
+                        use_container_width=True,
+                        hide_index=True,
+                        column_config={"Valor": st.column_config.NumberColumn(format="R$ %.2f")}
+                    )
+                if app_mode == "Casal":
+                    payer = st.selectbox("Quem pagou?", [person1_name, person2_name, "Ambos"])
+                    split_p1, split_p2 = (100, 0) if payer == person1_name else (0, 100) if payer == person2_name else (st.slider(f"{person1_name} (%)", 0, 100, 50), 0)
+                    if payer == "Ambos": split_p2 = 100 - split_p1; st.write(f"{person2_name}: {split_p2}%")
+                if st.button("Confirmar e Salvar", type="primary", use_container_width=True):
+                    pagador_to_save = person1_name if app_mode == 'Individual' else payer
+                    split_p1_to_save = split_p1 if app_mode == 'Casal' else None
+                    split_p2_to_save = split_p2 if app_mode == 'Casal' else None
+                    # Todo o lote é gravado numa única transação.
+                    success, msg = database_utils.add_expenses(username, items, pagador=pagador_to_save, split_p1=split_p1_to_save, split_p2=split_p2_to_save)
+                    if success:
+                        st.success(msg)
+                        del st.session_state.pending_expenses
+                        st.rerun()
+                    else: st.error(msg)
+                if st.button("Descartar", use_container_width=True):
+                    del st.session_state.pending_expenses
+                    st.rerun()
+        else:
+            st.info("Digite um gasto no chat abaixo para que ele seja registrado e apareça aqui para confirmação.")
+            voice_clip = st.audio_input("🎙️ Ou grave o gasto por voz")
+            if voice_clip:
+                clip_bytes = voice_clip.getvalue()
+                clip_hash = voice_utils.audio_hash(clip_bytes)
+                # O widget mantém o clipe entre reruns: só processa cada gravação uma vez.
+                if st.session_state.get('last_voice_clip') != clip_hash:
+                    st.session_state.last_voice_clip = clip_hash
+                    try:
+                        with st.spinner("Transcrevendo..."):
+                            transcript = voice_utils.transcribe(clip_bytes, TRANSCRIPTION_BACKEND, username=username)
+                    except ValueError as e:
+                        st.error(str(e))
+                    else:
+                        if transcript:
+                            processar_gasto(transcript, username)
+                        else:
+                            st.error("Não consegui transcrever o áudio. Tente de novo.")
+
+        with st.expander("📥 Importar Extrato (CSV/OFX)", expanded=False):
+            statement_file = st.file_uploader("Arquivo do banco", type=["csv", "ofx"])
+            expense_sign = st.radio("Despesas aparecem no arquivo como:", ("Valores negativos (extrato de conta)", "Valores positivos (fatura de cartão)"))
+            use_llm = st.checkbox("Usar IA para categorias incertas", value=False)
+            if statement_file and st.button("Importar", type="primary", use_container_width=True):
+                file_format = "ofx" if statement_file.name.lower().endswith(".ofx") else "csv"
+                with st.spinner("Importando..."):
+                    result = import_utils.import_statement(
+                        username, statement_file, file_format, CATEGORIES,
+                        expense_sign="negative" if expense_sign.startswith("Valores negativos") else "positive",
+                        llm_categorize=functools.partial(openai_utils.categorize_expenses_batch, username=username) if use_llm else None,
+                        threshold=PARSER_CONFIDENCE_THRESHOLD
+                    )
+                if result['success']:
+                    st.success(result['message'])
+                    if result['skipped']:
+                        st.warning(f"{result['skipped']} linha(s) ignorada(s) por data, valor ou descrição inválidos.")
+                else:
+                    st.error(result['message'])
+
+    @st.fragment
+    def painel_analise():
+        current_month_str = datetime.now().strftime("%Y-%m")
+        selected_month = st.text_input("Mês (AAAA-MM)", value=current_month_str)
+        if not selected_month:
+            return
+        expenses_df, total_cents = database_utils.get_monthly_expenses(username, selected_month)
+        if expenses_df.empty:
+            st.info("Nenhuma despesa registrada para o mês selecionado.")
+            return
+        # --- Preparação dos dados de análise (totais vêm do resumo mensal, sem groupby nas linhas) ---
+        month_totals = database_utils.get_monthly_category_totals(username, selected_month, selected_month)
+        analysis_df = chart_utils.budget_analysis(month_totals, category_budgets)
+        st.metric(f"Gasto Total em {selected_month}", f"R$ {database_utils.to_reais(total_cents):.2f}")
+        # Centavos só viram reais aqui, para exibição.
+        expenses_df['Valor'] = database_utils.to_reais(expenses_df['Centavos'])
+
+        if app_mode == "Casal" and not expenses_df['Pagador'].isnull().all():
+            st.subheader(f"Contribuições de {person1_name} vs {person2_name}")
+            paid_p1, paid_p2 = settlement_utils.contributions(expenses_df, person1_name, person2_name)
+            expenses_df['Valor ' + person1_name] = database_utils.to_reais(paid_p1)
+            expenses_df['Valor ' + person2_name] = database_utils.to_reais(paid_p2)
+            st.plotly_chart(chart_utils.contribution_pie_spec(username, selected_month, person1_name, person2_name), use_container_width=True)
+
+        # --- Tabela de Resumo: Gasto vs. Limite ---
+        st.subheader("Resumo: Gasto vs. Limite por Categoria")
+        summary_df = analysis_df.rename(columns={'Gasto': 'Gasto Total', 'Orçamento': 'Limite', 'Saldo': 'Saldo Restante'})
+        st.dataframe(
+            summary_df[['Categoria', 'Gasto Total', 'Limite', 'Saldo Restante']],
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                "Gasto Total": st.column_config.NumberColumn(format="R$ %.2f"),
+                "Limite": st.column_config.NumberColumn(format="R$ %.2f"),
+                "Saldo Restante": st.column_config.NumberColumn(format="R$ %.2f")
+            }
+        )
+
+        st.subheader("Planilha de Despesas")
+        if app_mode == "Casal":
+            display_cols = ['Data', 'Descrição', 'Categoria', 'Valor', 'Pagador', f'Valor {person1_name}', f'Valor {person2_name}']
+            st.dataframe(expenses_df.reindex(columns=display_cols).fillna(0), use_container_width=True, hide_index=True)
+        else:
+            st.dataframe(expenses_df[['Data', 'Descrição', 'Categoria', 'Valor']], use_container_width=True, hide_index=True)
+
+        st.subheader("Análise Gráfica")
+        col_graph1, col_graph2 = st.columns(2)
+        with col_graph1:
+            st.text("Gastos por Categoria")
+            st.plotly_chart(chart_utils.category_pie_spec(username, selected_month, category_budgets), use_container_width=True)
+        with col_graph2:
+            st.text("Gasto vs. Orçamento por Categoria")
+            st.plotly_chart(chart_utils.budget_bar_spec(username, selected_month, category_budgets), use_container_width=True)
+
+        # --- Dicas do consultor: resumo de tamanho fixo, em streaming, uma vez por versão dos dados ---
+        st.divider()
+        st.subheader("💡 Dicas do Consultor")
+        advice_digest = advice_utils.build_digest(username, selected_month, category_budgets)
+        advice_key = (selected_month, advice_utils.digest_version(advice_digest))
+        advice_by_month = st.session_state.setdefault('advice', {})
+        if advice_key in advice_by_month:
+            st.markdown(advice_by_month[advice_key])
+        elif st.button("Gerar dicas para o mês", use_container_width=True):
+            advice_stream = openai_utils.stream_financial_advice(
+                advice_utils.format_digest(advice_digest), f"{username}|{selected_month}|{advice_key[1]}", username=username
+            )
+            try:
+                advice_by_month[advice_key] = st.write_stream(advice_stream)
+            except Exception as e:
+                st.error(f"Desculpe, não consegui gerar as dicas no momento. Erro: {e}")
+        with st.expander("Resumo enviado ao consultor", expanded=False):
+            st.text(advice_utils.format_digest(advice_digest))
+
+        st.divider()
+        st.subheader("🗑️ Deletar uma Despesa")
+        # Rótulos montados de uma vez (sem iterrows); o selectbox guarda só o ID.
+        expense_labels = dict(zip(
+            expenses_df['id'].tolist(),
+            ("ID: " + expenses_df['id'].astype(str) + " | " + expenses_df['Data'].astype(str) + " | " + expenses_df['Descrição']
+             + " (" + expenses_df['Categoria'] + ") - R$" + expenses_df['Valor'].map("{:.2f}".format)).tolist()
+        ))
+        expense_id_to_delete = st.selectbox("Selecione a despesa para deletar", options=list(expense_labels), format_func=expense_labels.get)
+        if st.button("Deletar Despesa Selecionada", type="primary"):
+            if expense_id_to_delete is not None:
+                if database_utils.delete_expense(username, int(expense_id_to_delete)):
+                    st.success(f"Despesa ID {expense_id_to_delete} deletada com sucesso!")
+                    st.rerun()
+                else: st.error("Erro ao deletar a despesa.")
+            else: st.warning("Nenhuma despesa selecionada para deletar.")
+
+    @st.fragment
+    def painel_acerto():
+        st.header("🤝 Acerto de Contas")
+        col_range, col_share = st.columns([1.5, 1])
+        with col_range:
+            settlement_range = st.date_input("Período", value=(date(date.today().year, 1, 1), date.today()), format="DD/MM/YYYY")
+        with col_share:
+            # user_settings é o da última execução completa; dentro do fragmento ele fica velho, então
+            # a parte justa é salva pelo on_change, só quando o slider muda de fato.
+            fair_share_p1 = st.slider(
+                f"Parte justa de {person1_name} (%)", 0, 100, int(user_settings.get('fair_share_p1', 50)), key="fair_share_p1",
+                on_change=lambda: database_utils.save_setting(username, 'fair_share_p1', st.session_state.fair_share_p1)
+            )
+        if len(settlement_range) == 2:
+            range_start, range_end = settlement_range
+            # Intervalo semiaberto: inclui o último dia selecionado.
+            range_df, _ = database_utils.get_expenses_between(username, range_start, range_end + timedelta(days=1))
+            settlement = settlement_utils.compute_settlement(range_df, person1_name, person2_name, fair_share_p1 / 100.0)
+            col_s1, col_s2, col_s3 = st.columns(3)
+            col_s1.metric(f"{person1_name} pagou", f"R$ {settlement['pago'][person1_name]:.2f}", f"{settlement['saldo'][person1_name]:+.2f}")
+            col_s2.metric(f"{person2_name} pagou", f"R$ {settlement['pago'][person2_name]:.2f}", f"{settlement['saldo'][person2_name]:+.2f}")
+            col_s3.metric("Total Compartilhado", f"R$ {settlement['total']:.2f}")
+            if settlement['devedor']:
+                st.success(f"**{settlement['devedor']}** deve **R$ {settlement['valor']:.2f}** a **{settlement['credor']}**.")
+            else:
+                st.success("Vocês estão quites no período.")
+            if not range_df.empty:
+                monthly_df = settlement_utils.monthly_balance(range_df, person1_name, person2_name, fair_share_p1 / 100.0)
+                st.dataframe(
+                    monthly_df,
+                    use_container_width=True,
+                    hide_index=True,
+                    column_config={col: st.column_config.NumberColumn(format="R$ %.2f") for col in monthly_df.columns if col != 'Mês'}
+                )
+                st.caption(f"Saldo acumulado positivo: {person2_name} deve a {person1_name}; negativo: o contrário.")
+
+    @st.fragment
+    def painel_historico():
+        payer_options = ["Todos", person1_name, person2_name, "Ambos"] if app_mode == "Casal" else ["Todos"]
+        col_f1, col_f2, col_f3, col_f4 = st.columns([2, 1, 1, 1])
+        with col_f1:
+            history_categories = st.multiselect("Categorias", CATEGORIES, key="history_categories")
+            history_search = st.text_input("Buscar na descrição", key="history_search")
+        with col_f2:
+            history_payer = st.selectbox("Pagador", payer_options, key="history_payer", disabled=app_mode != "Casal")
+        with col_f3:
+            history_min = st.number_input("Valor mínimo", min_value=0.0, value=None, key="history_min")
+        with col_f4:
+            history_max = st.number_input("Valor máximo", min_value=0.0, value=None, key="history_max")
+        history_filters = {
+            'categorias': history_categories, 'pagador': None if history_payer == "Todos" else history_payer,
+            'valor_min': history_min, 'valor_max': history_max, 'busca': history_search.strip(),
+        }
+        # Cursores (data, id) das páginas já visitadas; mudar qualquer filtro volta à primeira página.
+        if st.session_state.get('history_filters') != history_filters:
+            st.session_state.history_filters = history_filters
+            st.session_state.history_cursors = [None]
+        cursors = st.session_state.history_cursors
+        page_df, next_cursor = database_utils.get_expense_page(username, history_filters, cursors[-1])
+        # Página que ficou vazia (ex.: a última linha da última página foi deletada): volta para a anterior.
+        while page_df.empty and len(cursors) > 1:
+            cursors.pop()
+            page_df, next_cursor = database_utils.get_expense_page(username, history_filters, cursors[-1])
+        if page_df.empty:
+            st.info("Nenhuma despesa encontrada com esses filtros.")
+            return
+        page_df['Valor'] = database_utils.to_reais(page_df['Centavos'])
+
+        display_cols = ['Data', 'Descrição', 'Categoria', 'Valor'] + (['Pagador'] if app_mode == "Casal" else [])
+        selection = st.dataframe(
+            page_df.set_index('id')[display_cols],
+            use_container_width=True,
+            on_select="rerun",
+            selection_mode="single-row",
+            column_config={"Valor": st.column_config.NumberColumn(format="R$ %.2f")}
+        )
+        col_prev, col_page, col_next = st.columns([1, 2, 1])
+        col_prev.button("← Anteriores", disabled=len(cursors) == 1, use_container_width=True, on_click=cursors.pop)
+        col_page.caption(f"Página {len(cursors)}")
+        col_next.button("Próximas →", disabled=next_cursor is None, use_container_width=True, on_click=cursors.append, args=(next_cursor,))
+
+        if not selection.selection.rows:
+            st.caption("Selecione uma linha para editar ou deletar.")
+            return
+        expense = page_df.iloc[selection.selection.rows[0]]
+        expense_id = int(expense['id'])
+        with st.form(f"edit_expense_{expense_id}"):
+            st.markdown(f"**Editar despesa ID {expense_id}**")
+            col_e1, col_e2 = st.columns(2)
+            new_description = col_e1.text_input("Descrição", value=expense['Descrição'])
+            new_value = col_e2.number_input("Valor", min_value=0.0, value=float(expense['Valor']), format="%.2f")
+            new_category = col_e1.selectbox("Categoria", CATEGORIES, index=CATEGORIES.index(expense['Categoria']) if expense['Categoria'] in CATEGORIES else CATEGORIES.index("Outros"))
+            new_date = col_e2.date_input("Data", value=pd.to_datetime(expense['Data']).date(), format="DD/MM/YYYY")
+            new_payer, new_split_p1, new_split_p2 = expense['Pagador'], expense['Split Pessoa 1'], expense['Split Pessoa 2']
+            if app_mode == "Casal":
+                payers = [person1_name, person2_name, "Ambos"]
+                new_payer = st.selectbox("Quem pagou?", payers, index=payers.index(new_payer) if new_payer in payers else 2)
+                saved_split = int(new_split_p1) if new_payer == "Ambos" and pd.notna(new_split_p1) else 50
+                split_both = st.slider(f"{person1_name} (%) quando ambos pagam", 0, 100, saved_split)
+                new_split_p1, new_split_p2 = (100, 0) if new_payer == person1_name else (0, 100) if new_payer == person2_name else (split_both, 100 - split_both)
+            col_save, col_delete = st.columns(2)
+            save_clicked = col_save.form_submit_button("Salvar alterações", type="primary", use_container_width=True)
+            delete_clicked = col_delete.form_submit_button("Deletar", use_container_width=True)
+        if save_clicked:
+            success, msg = database_utils.update_expense(
+                username, expense_id, new_description, new_value, new_category, new_date,
+                pagador=None if pd.isna(new_payer) else new_payer,
+                split_p1=None if pd.isna(new_split_p1) else new_split_p1,
+                split_p2=None if pd.isna(new_split_p2) else new_split_p2
+            )
+            if success:
+                st.rerun()
+            else: st.error(msg)
+        if delete_clicked:
+            if database_utils.delete_expense(username, expense_id):
+                st.rerun()
+            else: st.error("Erro ao deletar a despesa.")
+
+    def painel_exportacao():
+        export_job_id = st.session_state.get('export_job')
+        job = export_utils.get_job(export_job_id, username) if export_job_id else None
+        running = job is not None and job['status'] in ('queued', 'running')
+        if st.session_state.get('export_polling') and not running:
+            # Terminou: um rerun completo recria o fragmento sem a atualização periódica.
+            st.session_state.export_polling = False
+            st.rerun()
+        if running:
+            st.info(f"Exportando em segundo plano... {job['rows']} despesas gravadas.")
+            return
+        col_range, col_format, col_button = st.columns([2, 1, 1])
+        export_range = col_range.date_input("Período", value=(date(date.today().year, 1, 1), date.today()), format="DD/MM/YYYY", key="export_range")
+        export_format = col_format.selectbox("Formato", ("csv", "parquet"), key="export_format")
+        if col_button.button("Exportar", use_container_width=True) and len(export_range) == 2:
+            if export_job_id:
+                export_utils.discard(export_job_id)
+            # Intervalo semiaberto: inclui o último dia selecionado.
+            st.session_state.export_job = export_utils.start_export(username, export_range[0], export_range[1] + timedelta(days=1), export_format)
+            st.session_state.export_polling = True
+            st.rerun()
+        if job and job['status'] == 'done':
+            with open(job['path'], 'rb') as export_file:
+                st.download_button(
+                    f"Baixar {job['filename']} ({job['rows']} despesas)", export_file,
+                    file_name=job['filename'], mime=export_utils.CONTENT_TYPES[job['format']], use_container_width=True
+                )
+        elif job and job['status'] == 'error':
+            st.error(f"Erro na exportação: {job['error']}")
 
     with tab1:
         col_action, col_chat = st.columns([1, 1.5])
@@ -150,111 +490,100 @@ if st.session_state["authentication_status"]:
                     with st.chat_message(message["role"]):
                         st.markdown(message["content"])
         with col_action:
-            st.subheader("Ação Necessária")
-            if 'pending_expense' in st.session_state and st.session_state.pending_expense:
-                exp = st.session_state.pending_expense
-                with st.container(border=True):
-                    st.info(f"Despesa: **{exp['descricao']}** - **R${exp['valor']:.2f}**")
-                    if app_mode == "Casal":
-                        payer = st.selectbox("Quem pagou?", [person1_name, person2_name, "Ambos"])
-                        split_p1, split_p2 = (100, 0) if payer == person1_name else (0, 100) if payer == person2_name else (st.slider(f"{person1_name} (%)", 0, 100, 50), 0)
-                        if payer == "Ambos": split_p2 = 100 - split_p1; st.write(f"{person2_name}: {split_p2}%")
-                    if st.button("Confirmar e Salvar", type="primary", use_container_width=True):
-                        pagador_to_save = person1_name if app_mode == 'Individual' else payer
-                        split_p1_to_save = split_p1 if app_mode == 'Casal' else None
-                        split_p2_to_save = split_p2 if app_mode == 'Casal' else None
-                        success, msg = database_utils.add_expense(username, exp['descricao'], exp['valor'], exp['categoria'], pagador=pagador_to_save, split_p1=split_p1_to_save, split_p2=split_p2_to_save)
-                        if success:
-                            st.cache_data.clear()
-                            st.success(msg)
-                            del st.session_state.pending_expense
-                            st.rerun()
-                        else: st.error(msg)
-            else:
-                st.info("Digite um gasto no chat abaixo para que ele seja registrado e apareça aqui para confirmação.")
-    
+            painel_registro()
+
     with tab2:
         st.header("Análise Detalhada")
-        current_month_str = datetime.now().strftime("%Y-%m")
-        selected_month = st.text_input("Mês (AAAA-MM)", value=current_month_str)
-        if selected_month:
-            expenses_df, total_spent = database_utils.get_monthly_expenses(username, selected_month)
-            if expenses_df.empty:
-                st.info("Nenhuma despesa registrada para o mês selecionado.")
-            else:
-                st.metric(f"Gasto Total em {selected_month}", f"R$ {total_spent:.2f}")
-
-                # --- Preparação dos dados de análise (movido para cima para reuso) ---
-                category_spending = expenses_df.groupby('Categoria')['Valor'].sum()
-                budget_df = pd.DataFrame(list(category_budgets.items()), columns=['Categoria', 'Orçamento'])
-                analysis_df = budget_df.set_index('Categoria')
-                analysis_df['Gasto'] = category_spending
-                analysis_df = analysis_df.fillna(0).reset_index()
-                analysis_df['Saldo'] = analysis_df['Orçamento'] - analysis_df['Gasto']
-                
-                if app_mode == "Casal" and not expenses_df['Pagador'].isnull().all():
-                    st.subheader(f"Contribuições de {person1_name} vs {person2_name}")
-                    def calculate_contribution(row, person_name_to_check, split_col):
-                        if row['Pagador'] == person_name_to_check: return row['Valor']
-                        elif row['Pagador'] == 'Ambos' and pd.notna(row[split_col]): return row['Valor'] * (row[split_col] / 100.0)
-                        return 0
-                    expenses_df['Valor ' + person1_name] = expenses_df.apply(calculate_contribution, args=(person1_name, 'Split Pessoa 1'), axis=1)
-                    expenses_df['Valor ' + person2_name] = expenses_df.apply(calculate_contribution, args=(person2_name, 'Split Pessoa 2'), axis=1)
-                    total_p1 = expenses_df['Valor ' + person1_name].sum()
-                    total_p2 = expenses_df['Valor ' + person2_name].sum()
-                    contribution_data = pd.DataFrame({'Pessoa': [person1_name, person2_name], 'Valor Pago': [total_p1, total_p2]})
-                    fig_contrib = px.pie(contribution_data, names='Pessoa', values='Valor Pago', title='Quem Pagou Mais no Mês', hole=0.4, color_discrete_sequence=px.colors.sequential.RdBu)
-                    st.plotly_chart(fig_contrib, use_container_width=True)
-
-                # --- Tabela de Resumo: Gasto vs. Limite ---
-                st.subheader("Resumo: Gasto vs. Limite por Categoria")
-                summary_df = analysis_df.rename(columns={'Gasto': 'Gasto Total', 'Orçamento': 'Limite', 'Saldo': 'Saldo Restante'})
-                st.dataframe(
-                    summary_df[['Categoria', 'Gasto Total', 'Limite', 'Saldo Restante']],
-                    use_container_width=True,
-                    hide_index=True,
-                    column_config={
-                        "Gasto Total": st.column_config.NumberColumn(format="R$ %.2f"),
-                        "Limite": st.column_config.NumberColumn(format="R$ %.2f"),
-                        "Saldo Restante": st.column_config.NumberColumn(format="R$ %.2f")
-                    }
-                )
-                
-                st.subheader("Planilha de Despesas")
-                if app_mode == "Casal":
-                    display_cols = ['Data', 'Descrição', 'Categoria', 'Valor', 'Pagador', f'Valor {person1_name}', f'Valor {person2_name}']
-                    st.dataframe(expenses_df.reindex(columns=display_cols).fillna(0), use_container_width=True, hide_index=True)
-                else:
-                    st.dataframe(expenses_df[['Data', 'Descrição', 'Categoria', 'Valor']], use_container_width=True, hide_index=True)
-                
-                st.subheader("Análise Gráfica")
-                col_graph1, col_graph2 = st.columns(2)
-                with col_graph1:
-                    st.text("Gastos por Categoria")
-                    fig_pie = px.pie(analysis_df, names='Categoria', values='Gasto', hole=.3)
-                    fig_pie.update_traces(textposition='inside', textinfo='percent+label')
-                    st.plotly_chart(fig_pie, use_container_width=True)
-                with col_graph2:
-                    st.text("Gasto vs. Orçamento por Categoria")
-                    fig_bar = go.Figure()
-                    fig_bar.add_trace(go.Bar(x=analysis_df['Categoria'], y=analysis_df['Gasto'], name='Gasto Real', marker_color='indianred'))
-                    fig_bar.add_trace(go.Scatter(x=analysis_df['Categoria'], y=analysis_df['Orçamento'], name='Orçamento Definido', mode='lines+markers', line=dict(color='royalblue', dash='dash')))
-                    st.plotly_chart(fig_bar, use_container_width=True)
-                
-                st.divider()
-                st.subheader("🗑️ Deletar uma Despesa")
-                expense_options = [f"ID: {row.id} | {row.Data} | {row.Descrição} ({row.Categoria}) - R${row.Valor:.2f}" for index, row in expenses_df.iterrows()]
-                selected_expense_str = st.selectbox("Selecione a despesa para deletar", options=expense_options)
-                if st.button("Deletar Despesa Selecionada", type="primary"):
-                    if selected_expense_str:
-                        expense_id_to_delete = int(selected_expense_str.split(' ')[1])
-                        if database_utils.delete_expense(username, expense_id_to_delete):
-                            st.cache_data.clear()
-                            st.success(f"Despesa ID {expense_id_to_delete} deletada com sucesso!")
-                            st.rerun()
-                        else: st.error("Erro ao deletar a despesa.")
-                    else: st.warning("Nenhuma despesa selecionada para deletar.")
-
-    if 'pending_expense' not in st.session_state or not st.session_state.pending_expense:
+        painel_analise()
+        if app_mode == "Casal":
+            st.divider()
+            painel_acerto()
+
+    with tab3:
+        st.header("Tendências por Categoria")
+        window = st.radio("Janela", (12, 24), format_func=lambda n: f"Últimos {n} meses", horizontal=True)
+        all_months = pd.period_range(end=pd.Period(date.today(), freq='M'), periods=window, freq='M').strftime('%Y-%m')
+        trends_df = database_utils.get_monthly_category_totals(username, all_months[0], all_months[-1])
+        if trends_df.empty:
+            st.info("Nenhuma despesa registrada no período.")
+        else:
+            # Mês x Categoria, a partir do resumo mensal (nenhuma linha bruta é carregada).
+            trend_cents = trends_df.pivot_table(index='Mês', columns='Categoria', values='Centavos', aggfunc='sum', fill_value=0).reindex(all_months, fill_value=0)
+            trend_pivot = database_utils.to_reais(trend_cents)
+            fig_trend = px.line(trend_pivot, markers=True, labels={'index': 'Mês', 'value': 'Gasto (R$)', 'Categoria': 'Categoria'})
+            st.plotly_chart(fig_trend, use_container_width=True)
+
+            st.subheader("Variação Mês a Mês")
+            monthly_total = trend_cents.sum(axis=1)
+            total_df = pd.DataFrame({'Mês': trend_pivot.index, 'Total': database_utils.to_reais(monthly_total).values, 'Variação': database_utils.to_reais(monthly_total.diff()).values, 'Variação %': (monthly_total.diff() / monthly_total.shift().where(lambda x: x != 0) * 100).values})
+            st.dataframe(
+                total_df.iloc[::-1],
+                use_container_width=True,
+                hide_index=True,
+                column_config={
+                    "Total": st.column_config.NumberColumn(format="R$ %.2f"),
+                    "Variação": st.column_config.NumberColumn(format="R$ %.2f"),
+                    "Variação %": st.column_config.NumberColumn(format="%.1f%%")
+                }
+            )
+
+            current_label, previous_label = all_months[-1], all_months[-2]
+            st.subheader(f"Por Categoria: {current_label} vs {previous_label}")
+            current, previous = trend_cents.loc[current_label], trend_cents.loc[previous_label]
+            category_delta_df = pd.DataFrame({
+                'Categoria': trend_cents.columns,
+                'Mês Atual': database_utils.to_reais(current).values,
+                'Mês Anterior': database_utils.to_reais(previous).values,
+                'Variação': database_utils.to_reais(current - previous).values,
+                'Variação %': ((current - previous) / previous.where(previous != 0) * 100).values,
+            }).sort_values('Variação', ascending=False)
+            st.dataframe(
+                category_delta_df,
+                use_container_width=True,
+                hide_index=True,
+                column_config={
+                    "Mês Atual": st.column_config.NumberColumn(format="R$ %.2f"),
+                    "Mês Anterior": st.column_config.NumberColumn(format="R$ %.2f"),
+                    "Variação": st.column_config.NumberColumn(format="R$ %.2f"),
+                    "Variação %": st.column_config.NumberColumn(format="%.1f%%")
+                }
+            )
+
+    with tab4:
+        st.header("Histórico de Despesas")
+        painel_historico()
+        with st.expander("⬇️ Exportar (CSV/Parquet)", expanded=st.session_state.get('export_job') is not None):
+            # Enquanto há exportação em andamento, só este painel se atualiza a cada segundo.
+            st.fragment(painel_exportacao, run_every=1 if st.session_state.get('export_polling') else None)()
+
+    # --- PAINEL DE DEPURAÇÃO (apenas [debug] enabled = true ou usuários em [debug] admins) ---
+    debug_config = st.secrets.get("debug", {})
+    if debug_config.get("enabled") or username in debug_config.get("admins", []):
+        with st.sidebar:
+            st.divider()
+            with st.expander("🛠️ Consultas desta Execução", expanded=False):
+                query_summary = db_metrics.rerun_summary()
+                col_q1, col_q2 = st.columns(2)
+                col_q1.metric("Consultas", query_summary['count'])
+                col_q2.metric("Tempo Total", f"{query_summary['total_ms']:.0f} ms")
+                if query_summary['records']:
+                    st.dataframe(pd.DataFrame(query_summary['records']), use_container_width=True, hide_index=True)
+                st.caption("Acumulado do processo por ponto de chamada:")
+                site_totals = db_metrics.totals_by_site()
+                if site_totals:
+                    st.dataframe(
+                        pd.DataFrame.from_dict(site_totals, orient='index').sort_values('total_ms', ascending=False),
+                        use_container_width=True
+                    )
+            with st.expander("🛠️ Parser (todo o servidor)", expanded=False):
+                # Contadores do processo: somam as mensagens de todos os usuários desde o início.
+                parser_stats = parser_utils.stats.summary()
+                st.metric("Resolvidos localmente", f"{parser_stats['hit_rate']:.0%}", help=f"{parser_stats['total']} mensagens analisadas")
+                for path, label in (("local", "Parser local"), ("llm", "OpenAI")):
+                    path_stats = parser_stats['paths'].get(path)
+                    if path_stats:
+                        st.caption(f"{label}: {path_stats['calls']} chamadas, média de {path_stats['avg_ms']:.0f} ms")
+
+    if not st.session_state.get('pending_expenses'):
         if prompt := st.chat_input("Digite o gasto aqui..."):
             processar_gasto(prompt, username)
\ No newline at end of file
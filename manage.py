@@ -0,0 +1,83 @@
+# manage.py
+"""
+Comandos de manutenção do banco, para rodar fora do Streamlit:
+
+    python manage.py migrate
+    python manage.py check-plan --user USERNAME --month AAAA-MM
+    python manage.py rollups rebuild [--user USERNAME]
+    python manage.py rollups verify [--user USERNAME]
+"""
+import argparse
+import sys
+
+import database_utils
+import migrations
+
+
+def cmd_migrate(args):
+    """Aplica as migrações pendentes e mostra a versão do esquema."""
+    engine = database_utils.get_engine()
+    if not engine:
+        print("FALHOU: sem conexão com o banco.")
+        return 1
+    applied = migrations.migrate(engine, database_utils.get_backend())
+    for version, description, _ in migrations.MIGRATIONS:
+        if version in applied:
+            print(f"Aplicada {version}: {description}")
+    with engine.connect() as conn:
+        print(f"Esquema na versão {migrations.current_version(conn)}.")
+    return 0
+
+
+def cmd_check_plan(args):
+    """Falha (código 1) se a consulta mensal não usar o índice de despesas."""
+    try:
+        nodes = database_utils.check_month_query_plan(args.user, args.month)
+    except RuntimeError as e:
+        print(f"FALHOU: {e}")
+        return 1
+    print(f"OK: plano usa {' -> '.join(nodes)}")
+    return 0
+
+
+def cmd_rollups(args):
+    """Recalcula ou confere o resumo mensal por categoria (código 1 se houver divergência)."""
+    if args.action == "rebuild":
+        if not database_utils.rebuild_monthly_rollups(args.user):
+            print("FALHOU: sem conexão com o banco.")
+            return 1
+        print("Resumo mensal recalculado.")
+        return 0
+    mismatches = database_utils.verify_monthly_rollups(args.user)
+    for username, mes, categoria, expected, stored in mismatches:
+        print(f"DIVERGENTE: {username} {mes:%Y-%m} {categoria}: esperado {expected}, armazenado {stored}")
+    if mismatches:
+        print(f"FALHOU: {len(mismatches)} divergência(s). Rode 'python manage.py rollups rebuild'.")
+        return 1
+    print("OK: resumo mensal confere com as despesas.")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manutenção do banco do Agente Financeiro.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate = subparsers.add_parser("migrate", help="Aplica as migrações pendentes do esquema.")
+    migrate.set_defaults(func=cmd_migrate)
+
+    check_plan = subparsers.add_parser("check-plan", help="Verifica via EXPLAIN se a consulta mensal usa índice.")
+    check_plan.add_argument("--user", required=True)
+    check_plan.add_argument("--month", required=True, help="Mês no formato AAAA-MM")
+    check_plan.set_defaults(func=cmd_check_plan)
+
+    rollups = subparsers.add_parser("rollups", help="Recalcula ou confere o resumo mensal por categoria.")
+    rollups.add_argument("action", choices=["rebuild", "verify"])
+    rollups.add_argument("--user", help="Limita a um usuário (padrão: todos)")
+    rollups.set_defaults(func=cmd_rollups)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+# migrations.py
+import hashlib
+
+from sqlalchemy import text
+
+# --- MIGRAÇÕES VERSIONADAS DO ESQUEMA ---
+# Cada passo é (versão, descrição, função(conn, backend)) e roda uma única vez, na sua
+# própria transação, registrando a versão em schema_version. Novos índices, tabelas e
+# mudanças de tipo entram sempre como um passo novo no FIM da lista - nunca edite um passo
+# já publicado. As versões 1 a 3 usam IF NOT EXISTS para adotar bancos criados antes das
+# migrações existirem.
+
+
+def _v1_base_tables(conn, backend):
+    conn.execute(text("""
+    CREATE TABLE IF NOT EXISTS users (
+        username VARCHAR(255) PRIMARY KEY, name VARCHAR(255) NOT NULL,
+        email VARCHAR(255) NOT NULL UNIQUE, hashed_password TEXT NOT NULL
+    )"""))
+    conn.execute(text(f"""
+    CREATE TABLE IF NOT EXISTS despesas (
+        id {backend.id_column}, username VARCHAR(255) NOT NULL, descricao TEXT NOT NULL,
+        valor REAL NOT NULL, categoria VARCHAR(255) NOT NULL, data DATE NOT NULL,
+        pagador VARCHAR(255), split_pessoa1 REAL, split_pessoa2 REAL
+    )"""))
+    conn.execute(text("""
+    CREATE TABLE IF NOT EXISTS orcamentos_categoria (
+        username VARCHAR(255) NOT NULL, categoria VARCHAR(255) NOT NULL,
+        limite REAL NOT NULL, PRIMARY KEY (username, categoria)
+    )"""))
+    conn.execute(text("""
+    CREATE TABLE IF NOT EXISTS app_settings (
+        username VARCHAR(255) NOT NULL, key VARCHAR(255) NOT NULL,
+        value TEXT NOT NULL, PRIMARY KEY (username, key)
+    )"""))
+
+
+def _v2_expenses_user_date_index(conn, backend):
+    # Índice composto: mantém as buscas por mês/trimestre/intervalo presas ao índice.
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_despesas_username_data ON despesas (username, data)"))
+
+
+def _v3_monthly_rollup(conn, backend):
+    conn.execute(text("""
+    CREATE TABLE IF NOT EXISTS resumo_mensal_categoria (
+        username VARCHAR(255) NOT NULL, mes DATE NOT NULL, categoria VARCHAR(255) NOT NULL,
+        total DOUBLE PRECISION NOT NULL DEFAULT 0, quantidade INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (username, mes, categoria)
+    )"""))
+    # Popula (ou refaz) o resumo a partir das despesas já existentes.
+    month = backend.month_trunc('data')
+    conn.execute(text("DELETE FROM resumo_mensal_categoria"))
+    conn.execute(text(f"""
+    INSERT INTO resumo_mensal_categoria (username, mes, categoria, total, quantidade)
+    SELECT username, {month}, categoria, SUM(valor), COUNT(*) FROM despesas
+    GROUP BY username, {month}, categoria
+    """))
+
+
+def _v4_users_lower_username_index(conn, backend):
+    # O login busca um único usuário por LOWER(username); sem o índice seria uma varredura.
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_users_username_lower ON users (LOWER(username))"))
+
+
+def _v5_expenses_keyset_index(conn, backend):
+    # Paginação do histórico por (data, id) dentro do usuário. O novo índice cobre tudo o que o
+    # (username, data) atendia, então o antigo sai para não pesar nas escritas.
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_despesas_username_data_id ON despesas (username, data, id)"))
+    conn.execute(text("DROP INDEX IF EXISTS idx_despesas_username_data"))
+
+
+def _v6_expenses_description_search(conn, backend):
+    backend.create_trigram_index(conn, 'despesas', 'descricao')
+
+
+def _v7_money_in_cents(conn, backend):
+    # Dinheiro passa a centavos inteiros (BIGINT): somas exatas no banco e no pandas, sem o
+    # arredondamento acumulado do REAL. Os splits são percentuais e viram SMALLINT. Como o
+    # SQLite não muda o tipo de uma coluna, as três tabelas são recriadas com os dados convertidos.
+    # As tabelas de passagem (*_v7) são descartadas antes, caso sobrem de uma tentativa anterior.
+    conn.execute(text("DROP TABLE IF EXISTS despesas_v7"))
+    conn.execute(text(f"""
+    CREATE TABLE despesas_v7 (
+        id {backend.id_column}, username VARCHAR(255) NOT NULL, descricao TEXT NOT NULL,
+        valor_centavos BIGINT NOT NULL, categoria VARCHAR(255) NOT NULL, data DATE NOT NULL,
+        pagador VARCHAR(255), split_pessoa1 SMALLINT, split_pessoa2 SMALLINT
+    )"""))
+    conn.execute(text("""
+    INSERT INTO despesas_v7 (id, username, descricao, valor_centavos, categoria, data, pagador, split_pessoa1, split_pessoa2)
+    SELECT id, username, descricao, CAST(ROUND(CAST(valor AS DOUBLE PRECISION) * 100) AS BIGINT), categoria, data, pagador,
+           CAST(ROUND(split_pessoa1) AS SMALLINT), CAST(ROUND(split_pessoa2) AS SMALLINT)
+    FROM despesas
+    """))
+    conn.execute(text("DROP TABLE despesas"))
+    conn.execute(text("ALTER TABLE despesas_v7 RENAME TO despesas"))
+    backend.reset_id_sequence(conn, 'despesas')
+    conn.execute(text("CREATE INDEX idx_despesas_username_data_id ON despesas (username, data, id)"))
+    backend.create_trigram_index(conn, 'despesas', 'descricao')
+
+    conn.execute(text("DROP TABLE IF EXISTS orcamentos_categoria_v7"))
+    conn.execute(text("""
+    CREATE TABLE orcamentos_categoria_v7 (
+        username VARCHAR(255) NOT NULL, categoria VARCHAR(255) NOT NULL,
+        limite_centavos BIGINT NOT NULL, PRIMARY KEY (username, categoria)
+    )"""))
+    conn.execute(text("""
+    INSERT INTO orcamentos_categoria_v7 (username, categoria, limite_centavos)
+    SELECT username, categoria, CAST(ROUND(CAST(limite AS DOUBLE PRECISION) * 100) AS BIGINT) FROM orcamentos_categoria
+    """))
+    conn.execute(text("DROP TABLE orcamentos_categoria"))
+    conn.execute(text("ALTER TABLE orcamentos_categoria_v7 RENAME TO orcamentos_categoria"))
+
+    # O resumo é derivado: recriado vazio e repopulado, agora exato, a partir das despesas.
+    conn.execute(text("DROP TABLE resumo_mensal_categoria"))
+    conn.execute(text("""
+    CREATE TABLE resumo_mensal_categoria (
+        username VARCHAR(255) NOT NULL, mes DATE NOT NULL, categoria VARCHAR(255) NOT NULL,
+        total_centavos BIGINT NOT NULL DEFAULT 0, quantidade INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (username, mes, categoria)
+    )"""))
+    month = backend.month_trunc('data')
+    conn.execute(text(f"""
+    INSERT INTO resumo_mensal_categoria (username, mes, categoria, total_centavos, quantidade)
+    SELECT username, {month}, categoria, SUM(valor_centavos), COUNT(*) FROM despesas
+    GROUP BY username, {month}, categoria
+    """))
+
+
+def expense_hash(data, centavos, descricao):
+    """
+    Hash de deduplicação de (data, valor em centavos, descrição), tolerante a caixa/espaços.
+    Fica gravado em despesas.hash_importacao: mudar a fórmula exige uma nova migração.
+    """
+    key = f"{data.isoformat() if hasattr(data, 'isoformat') else data}|{int(centavos)}|{' '.join(descricao.lower().split())}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def _v8_import_dedup_key(conn, backend):
+    # A importação de extratos grava o hash da linha e a ocorrência (a N-ésima linha igual do
+    # arquivo) e o índice único descarta o que já foi importado. As despesas existentes recebem
+    # o hash e são numeradas por id, para que reimportar um extrato antigo não as duplique.
+    conn.execute(text("ALTER TABLE despesas ADD COLUMN hash_importacao VARCHAR(64)"))
+    conn.execute(text("ALTER TABLE despesas ADD COLUMN ocorrencia INTEGER"))
+    select_sql = text("SELECT id, data, valor_centavos, descricao FROM despesas WHERE id > :after ORDER BY id LIMIT 5000")
+    update_sql = text("UPDATE despesas SET hash_importacao = :hash WHERE id = :id")
+    after = 0
+    while rows := conn.execute(select_sql, {'after': after}).fetchall():
+        conn.execute(update_sql, [{'id': r.id, 'hash': expense_hash(r.data, r.valor_centavos, r.descricao)} for r in rows])
+        after = rows[-1].id
+    conn.execute(text("""
+    UPDATE despesas SET ocorrencia = numeradas.ocorrencia
+    FROM (SELECT id, ROW_NUMBER() OVER (PARTITION BY username, hash_importacao ORDER BY id) AS ocorrencia FROM despesas) AS numeradas
+    WHERE despesas.id = numeradas.id
+    """))
+    conn.execute(text("CREATE UNIQUE INDEX idx_despesas_importacao ON despesas (username, hash_importacao, ocorrencia)"))
+
+
+MIGRATIONS = [
+    (1, "Tabelas base (users, despesas, orcamentos_categoria, app_settings)", _v1_base_tables),
+    (2, "Índice (username, data) em despesas", _v2_expenses_user_date_index),
+    (3, "Resumo mensal por categoria", _v3_monthly_rollup),
+    (4, "Índice em LOWER(username) para o login", _v4_users_lower_username_index),
+    (5, "Índice (username, data, id) em despesas para o histórico", _v5_expenses_keyset_index),
+    (6, "Índice trigram na descrição das despesas (só Postgres)", _v6_expenses_description_search),
+    (7, "Valores em centavos inteiros e splits em percentual inteiro", _v7_money_in_cents),
+    (8, "Hash e ocorrência das linhas importadas, com índice único", _v8_import_dedup_key),
+]
+
+
+def current_version(conn):
+    """Maior versão aplicada (0 para banco sem migrações)."""
+    return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar()
+
+
+def migrate(engine, backend):
+    """
+    Aplica, em ordem, as migrações ainda não registradas em schema_version. Cada passo roda
+    na sua transação, sob o lock de migração do backend, para que dois processos subindo ao
+    mesmo tempo não apliquem o mesmo passo. Retorna a lista de versões aplicadas.
+    """
+    with engine.begin() as conn:
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY, descricao TEXT NOT NULL,
+            aplicada_em TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )"""))
+    applied = []
+    for version, description, step in MIGRATIONS:
+        with engine.begin() as conn:
+            backend.lock_migrations(conn)
+            if current_version(conn) >= version:
+                continue
+            step(conn, backend)
+            conn.execute(text("INSERT INTO schema_version (version, descricao) VALUES (:version, :descricao)"),
+                         {'version': version, 'descricao': description})
+            applied.append(version)
+    return applied
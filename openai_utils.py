@@ -1,36 +1,61 @@
 # openai_utils.py
 import streamlit as st
-import openai
 import json
-import io # Necessário para tratar os bytes de áudio
 
-# Configura a chave da API da OpenAI
-openai.api_key = st.secrets["OPENAI_API_KEY"]
+import llm_gateway
+
+# Todas as chamadas passam pelo llm_gateway (cache persistente, single-flight, limite de
+# requisições e métricas por usuário). Configuração opcional no secrets.toml:
+#
+#   [llm]
+#   base_url = "http://127.0.0.1:8765/v1"   # ex.: fake_openai_server.py
+#   cache_path = ".llm_cache.sqlite"
+#   cache_max_entries = 5000
+#   requests_per_minute = 60
+#
+# Sem secrets.toml (benchmark, scripts), o SDK usa OPENAI_API_KEY e OPENAI_BASE_URL do ambiente.
+def _secrets():
+    try:
+        return dict(st.secrets)
+    except Exception:
+        return {}
+
+_secrets_config = _secrets()
+_llm_config = _secrets_config.get("llm", {})
+gateway = llm_gateway.LLMGateway(
+    api_key=_secrets_config.get("OPENAI_API_KEY"),
+    base_url=_llm_config.get("base_url"),
+    cache_path=_llm_config.get("cache_path", llm_gateway.DEFAULT_CACHE_PATH),
+    cache_max_entries=_llm_config.get("cache_max_entries", llm_gateway.DEFAULT_CACHE_MAX_ENTRIES),
+    requests_per_minute=_llm_config.get("requests_per_minute", llm_gateway.DEFAULT_REQUESTS_PER_MINUTE),
+)
+
+# Limites por chamada usados na extração concorrente de várias despesas. DEFAULT_RETRIES conta
+# só as novas tentativas por JSON ilegível; as de transporte ficam no llm_gateway.
+DEFAULT_TIMEOUT_SECONDS = 20
+DEFAULT_RETRIES = 2
+
+# Versões dos templates de prompt: mude a versão ao editar o texto fixo de um prompt, para
+# que as respostas antigas deixem de ser usadas pelo cache do gateway.
+EXPENSE_PROMPT_VERSION = "despesa-v1"
+BATCH_PROMPT_VERSION = "lote-v1"
+ADVICE_PROMPT_VERSION = "dicas-v2"
 
 # --- NOVA FUNÇÃO DE TRANSCRIÇÃO ---
-def transcribe_audio(audio_bytes):
+def transcribe_audio(audio_bytes, username=None):
     """
     Usa a API Whisper da OpenAI para transcrever um áudio.
     """
     try:
-        # O Whisper precisa de um objeto 'file-like' com um nome.
-        # Usamos io.BytesIO para tratar os bytes em memória como um arquivo.
-        audio_file = io.BytesIO(audio_bytes)
-        
-        # Enviamos para a API de transcrição
-        transcript = openai.audio.transcriptions.create(
-            model="whisper-1",
-            file=("audio.wav", audio_file) # Passamos como uma tupla (nome, objeto_arquivo)
-        )
-        return transcript.text
+        return gateway.transcribe(audio_bytes, username=username)
     except Exception as e:
         print(f"Erro na transcrição do áudio: {e}")
         return None
 
 
-# --- Funções existentes (sem alterações) ---
+# --- EXTRAÇÃO, CATEGORIZAÇÃO E DICAS (todas pelo llm_gateway) ---
 
-def analyze_expense_text(user_input, categories):
+def _request_expense(user_input, categories, timeout, username):
     category_list_str = ", ".join(categories)
     prompt = f"""
     Você é um assistente de finanças. Analise o texto do usuário para identificar uma despesa.
@@ -49,38 +74,101 @@ def analyze_expense_text(user_input, categories):
 
     Texto do usuário: "{user_input}"
     """
+    return gateway.chat(
+        [{"role": "system", "content": prompt}],
+        model="gpt-4-turbo",
+        template_version=EXPENSE_PROMPT_VERSION,
+        cache_input=user_input,
+        categories=categories,
+        username=username,
+        purpose="despesa",
+        parse=json.loads,
+        temperature=0.1,
+        max_tokens=150,
+        response_format={"type": "json_object"},
+        timeout=timeout
+    )
+
+def analyze_expense_text(user_input, categories, timeout=None, username=None):
+    try:
+        return _request_expense(user_input, categories, timeout, username)
+    except Exception as e:
+        return {"error": str(e)}
+
+def analyze_expense_with_retry(user_input, categories, timeout=DEFAULT_TIMEOUT_SECONDS, retries=DEFAULT_RETRIES, username=None):
+    """
+    Como analyze_expense_text, mas pede de novo quando o modelo devolve um JSON ilegível.
+    Falhas de rede e limite de requisições já são repetidas pelo gateway e não passam daqui.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return _request_expense(user_input, categories, timeout, username)
+        except json.JSONDecodeError as e:
+            error = e
+        except Exception as e:
+            return {"error": str(e)}
+    return {"error": str(error)}
+
+def categorize_expenses_batch(descriptions, categories, timeout=DEFAULT_TIMEOUT_SECONDS, username=None):
+    """
+    Classifica várias descrições numa única chamada. Retorna uma lista de categorias na
+    mesma ordem, ou None se a resposta não puder ser usada.
+    """
+    category_list_str = ", ".join(categories)
+    numbered = "\n".join(f"{i}. {d}" for i, d in enumerate(descriptions))
+    prompt = f"""
+    Você é um assistente de finanças. Classifique cada lançamento de extrato bancário abaixo
+    em uma das seguintes categorias: {category_list_str}.
+
+    Responda APENAS com um objeto JSON no formato {{"categorias": ["Categoria do item 0", "Categoria do item 1", ...]}},
+    com exatamente {len(descriptions)} itens, na mesma ordem.
+
+    Lançamentos:
+    {numbered}
+    """
     try:
-        response = openai.chat.completions.create(
+        result = gateway.chat(
+            [{"role": "system", "content": prompt}],
             model="gpt-4-turbo",
-            messages=[{"role": "system", "content": prompt}],
+            template_version=BATCH_PROMPT_VERSION,
+            cache_input=numbered,
+            categories=categories,
+            username=username,
+            purpose="importacao",
+            parse=json.loads,
             temperature=0.1,
-            max_tokens=150,
-            response_format={"type": "json_object"}
-        )
-        analysis = json.loads(response.choices[0].message.content)
-        return analysis
+            response_format={"type": "json_object"},
+            timeout=timeout
+        ).get("categorias", [])
+        if len(result) != len(descriptions):
+            return None
+        return [c if c in categories else "Outros" for c in result]
     except Exception as e:
-        return {"error": str(e)}
+        print(f"Erro ao categorizar lote: {e}")
+        return None
 
-def get_financial_advice(monthly_total, budget, expenses_df):
+def stream_financial_advice(digest_text, cache_input, username=None):
+    """
+    Gera as dicas em streaming a partir do resumo estatístico do mês (advice_utils). cache_input
+    identifica (usuário, mês, versão dos dados): as dicas só são pedidas de novo quando ele muda.
+    """
     prompt = f"""
-    Você é um consultor financeiro. Um usuário tem um orçamento mensal de R${budget:.2f}
-    e já gastou R${monthly_total:.2f} este mês.
+    Você é um consultor financeiro. Abaixo está o resumo dos gastos de um usuário no mês,
+    com o orçamento de cada categoria e a comparação com os meses anteriores:
 
-    Aqui está um resumo das despesas dele:
-    {expenses_df.to_string()}
+    {digest_text}
 
     Com base nisso, forneça 2-3 dicas práticas e amigáveis para ele gerenciar melhor seus gastos.
     Seja conciso.
     """
-    try:
-        response = openai.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "Você é um consultor financeiro prestativo."},
-                {"role": "user", "content": prompt}
-            ]
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        return f"Desculpe, não consegui gerar as dicas no momento. Erro: {e}"
\ No newline at end of file
+    return gateway.chat_stream(
+        [
+            {"role": "system", "content": "Você é um consultor financeiro prestativo."},
+            {"role": "user", "content": prompt}
+        ],
+        model="gpt-3.5-turbo",
+        template_version=ADVICE_PROMPT_VERSION,
+        cache_input=cache_input,
+        username=username,
+        purpose="dicas"
+    )
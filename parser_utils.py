@@ -0,0 +1,252 @@
+# parser_utils.py
+import re
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import cache_utils
+import database_utils
+
+# --- PARSER LOCAL DE DESPESAS ---
+# Resolve mensagens simples ("mercado 85,90", "R$ 1.234,56 aluguel", "uber 23 reais")
+# sem chamar a OpenAI. Só quando a confiança fica abaixo do limite configurado é que o
+# app recorre ao analyze_expense_text.
+
+DEFAULT_CONFIDENCE_THRESHOLD = 0.6
+
+_AMOUNT_RE = re.compile(r"""
+    (?P<prefix>r\$\s*)?
+    (?<![\w.,])
+    (?P<number>\d{1,3}(?:\.\d{3})+(?:,\d{1,2})?|\d+(?:[.,]\d{1,2})?)
+    (?![\d])
+    (?P<suffix>\s*(?:reais|real|contos?|pilas?)\b)?
+""", re.IGNORECASE | re.VERBOSE)
+
+_STOPWORDS = {
+    "gastei", "paguei", "comprei", "foi", "deu", "custou", "no", "na", "nos", "nas", "do", "da",
+    "dos", "das", "de", "com", "em", "o", "a", "os", "as", "um", "uma", "r", "reais", "real",
+    "por", "pra", "para", "hoje", "ontem", "e",
+}
+
+# Palavras-chave iniciais por categoria; o classificador soma a elas o histórico do usuário.
+SEED_KEYWORDS = {
+    "Diversão": ["cinema", "bar", "show", "netflix", "spotify", "ingresso", "balada", "festa", "jogo", "pizza", "cerveja", "restaurante", "ifood"],
+    "Alguel/Condomínio": ["aluguel", "alguel", "condominio", "iptu"],
+    "Carro": ["gasolina", "combustivel", "posto", "estacionamento", "ipva", "oficina", "mecanico", "pedagio", "uber", "taxi", "etanol"],
+    "Supermercado": ["mercado", "supermercado", "padaria", "feira", "hortifruti", "acougue", "atacadao", "carrefour", "assai", "pao"],
+    "Limpeza": ["limpeza", "detergente", "sabao", "diarista", "faxina", "amaciante", "desinfetante", "vassoura"],
+    "Marmitas": ["marmita", "marmitas", "quentinha", "almoco", "refeicao"],
+    "Investimento": ["investimento", "tesouro", "cdb", "acoes", "poupanca", "aporte", "fii"],
+    "Saúde": ["farmacia", "drogaria", "remedio", "medico", "consulta", "exame", "dentista", "academia"],
+    "Luz/Internet": ["luz", "energia", "internet", "wifi", "celular", "telefone", "agua"],
+}
+SEED_WEIGHT = 3.0
+
+
+def normalize(text):
+    """Minúsculas e sem acentos, para comparar palavras de forma estável."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    """Quebra o texto em palavras normalizadas, ignorando números e palavras de ligação."""
+    return [t for t in re.findall(r"[a-z]+", normalize(text)) if t not in _STOPWORDS and len(t) > 1]
+
+
+def _to_float(number):
+    if "," in number:
+        return float(number.replace(".", "").replace(",", "."))
+    if re.fullmatch(r"\d{1,3}(?:\.\d{3})+", number):
+        return float(number.replace(".", ""))
+    return float(number)
+
+
+def parse_amount(text):
+    """
+    Extrai o valor em reais do texto. Retorna (valor, trecho_encontrado, confiança) ou
+    (None, None, 0.0). Números marcados com 'R$' ou 'reais' têm prioridade; vários números
+    sem marcação deixam a confiança baixa.
+    """
+    matches = list(_AMOUNT_RE.finditer(text))
+    if not matches:
+        return None, None, 0.0
+    marked = [m for m in matches if m.group("prefix") or m.group("suffix")]
+    if len(marked) == 1:
+        match, confidence = marked[0], 1.0
+    elif len(matches) == 1:
+        match, confidence = matches[0], 0.95
+    else:
+        match, confidence = (marked or matches)[-1], 0.5
+    value = _to_float(match.group("number"))
+    if value <= 0:
+        return None, None, 0.0
+    return value, match.group(0), confidence
+
+
+def build_description(text, amount_span=None):
+    """Monta a descrição removendo o valor e as palavras de ligação do texto original."""
+    if amount_span:
+        text = text.replace(amount_span, " ", 1)
+    words = [w for w in re.findall(r"[^\W\d_]+", text) if normalize(w) not in _STOPWORDS and len(w) > 1]
+    if not words:
+        return None
+    description = " ".join(words)
+    return description[0].upper() + description[1:]
+
+
+# --- CLASSIFICADOR POR PALAVRAS-CHAVE ---
+
+def build_classifier(categories, samples=()):
+    """
+    Monta o modelo {palavra: {categoria: peso}} a partir das palavras-chave iniciais e das
+    despesas já registradas (descricao, categoria) pelo usuário.
+    """
+    model = defaultdict(lambda: defaultdict(float))
+    for category in categories:
+        for keyword in SEED_KEYWORDS.get(category, []):
+            model[keyword][category] += SEED_WEIGHT
+        for token in tokenize(category):
+            model[token][category] += SEED_WEIGHT
+    valid = set(categories)
+    for descricao, categoria in samples:
+        if categoria in valid:
+            for token in set(tokenize(descricao)):
+                model[token][categoria] += 1.0
+    return {token: dict(weights) for token, weights in model.items()}
+
+
+@cache_utils.user_cache('despesas', maxsize=256, copy_values=False)
+def get_user_classifier(username, categories):
+    """
+    Classificador do usuário (cacheado até a próxima despesa registrada ou removida). O mesmo
+    objeto é compartilhado entre as chamadas: trate-o como somente leitura.
+    """
+    samples = database_utils.get_category_samples(username)
+    return build_classifier(categories, samples)
+
+
+def classify(text, model, fallback="Outros"):
+    """Retorna (categoria, confiança) somando a distribuição de cada palavra conhecida."""
+    scores = defaultdict(float)
+    for token in tokenize(text):
+        weights = model.get(token)
+        if weights:
+            total = sum(weights.values())
+            for category, weight in weights.items():
+                scores[category] += weight / total
+    if not scores:
+        return fallback, 0.0
+    best = max(scores, key=scores.get)
+    return best, scores[best] / sum(scores.values())
+
+
+def parse_expense(text, categories, model):
+    """
+    Tenta extrair {'descricao', 'valor', 'categoria', 'confianca'} localmente.
+    Retorna None quando não encontra valor ou descrição.
+    """
+    value, span, amount_confidence = parse_amount(text)
+    if value is None:
+        return None
+    description = build_description(text, span)
+    if not description:
+        return None
+    category, category_confidence = classify(description, model)
+    return {
+        "descricao": description,
+        "valor": value,
+        "categoria": category,
+        "confianca": amount_confidence * category_confidence,
+    }
+
+
+# --- MÉTRICAS DOS CAMINHOS LOCAL x LLM ---
+
+class PathStats:
+    """Contadores de uso e latência por caminho ('local' ou 'llm'), seguros entre threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = defaultdict(int)
+        self._total_ms = defaultdict(float)
+
+    def record(self, path, elapsed_ms):
+        with self._lock:
+            self._calls[path] += 1
+            self._total_ms[path] += elapsed_ms
+
+    def summary(self):
+        """Retorna {'total', 'hit_rate', 'paths': {caminho: {'calls', 'avg_ms'}}}."""
+        with self._lock:
+            total = sum(self._calls.values())
+            return {
+                "total": total,
+                "hit_rate": self._calls["local"] / total if total else 0.0,
+                "paths": {
+                    path: {"calls": calls, "avg_ms": self._total_ms[path] / calls}
+                    for path, calls in self._calls.items() if calls
+                },
+            }
+
+
+stats = PathStats()
+
+
+# --- MENSAGENS COM VÁRIAS DESPESAS ---
+
+# Separa em ';', quebras de linha, ' e ' e vírgulas que não sejam decimais ("85,90").
+_SPLIT_RE = re.compile(r"\s*(?:;|\n|,(?!\d)|\be\b)\s*", re.IGNORECASE)
+
+
+def split_message(text):
+    """
+    Divide "uber 23, padaria 12 e farmácia 48" em trechos com um valor cada. Trechos sem
+    valor são juntados ao seguinte ("pão e leite 20" continua sendo uma despesa só).
+    """
+    segments, buffer = [], ""
+    for part in _SPLIT_RE.split(text):
+        if not part.strip():
+            continue
+        buffer = f"{buffer} e {part}" if buffer else part
+        if _AMOUNT_RE.search(buffer):
+            segments.append(buffer.strip())
+            buffer = ""
+    if buffer:
+        if segments:
+            segments[-1] = f"{segments[-1]} e {buffer}".strip()
+        else:
+            segments.append(buffer.strip())
+    return segments
+
+
+def analyze_batch(segments, categories, username, llm_analyze, threshold=DEFAULT_CONFIDENCE_THRESHOLD, max_workers=4):
+    """
+    Analisa vários trechos: o parser local resolve o que puder e os demais vão ao
+    llm_analyze em paralelo (thread pool). Timeouts e novas tentativas ficam a cargo do
+    llm_analyze. Retorna a lista de análises na ordem dos trechos.
+    """
+    model = get_user_classifier(username, categories)
+    results, pending = [None] * len(segments), []
+    for i, segment in enumerate(segments):
+        start = time.perf_counter()
+        local = parse_expense(segment, categories, model)
+        if local and local["confianca"] >= threshold:
+            stats.record("local", (time.perf_counter() - start) * 1000)
+            results[i] = {**local, "origem": "local"}
+        else:
+            pending.append(i)
+
+    def run_llm(index):
+        start = time.perf_counter()
+        analysis = llm_analyze(segments[index], categories)
+        stats.record("llm", (time.perf_counter() - start) * 1000)
+        return {**analysis, "origem": "llm"}
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(pending))) as executor:
+            for index, analysis in zip(pending, executor.map(run_llm, pending)):
+                results[index] = analysis
+    return results
@@ -0,0 +1,69 @@
+# settlement_utils.py
+import numpy as np
+import pandas as pd
+
+# --- ACERTO DE CONTAS DO CASAL ---
+# Tudo aqui é vetorizado sobre as colunas do DataFrame de despesas (ver
+# database_utils.EXPENSE_COLUMNS), sem apply linha a linha, para que um ano inteiro de
+# despesas compartilhadas seja processado em milissegundos.
+
+
+def contributions(expenses_df, person1_name, person2_name):
+    """
+    Retorna (pago_p1, pago_p2) em centavos, como arrays NumPy int64: o valor integral quando a
+    pessoa pagou sozinha e a fração do split quando o pagador é 'Ambos'. A parte da Pessoa 1 é
+    arredondada ao centavo e a da Pessoa 2 fica com o resto, então as duas somam o valor exato.
+    """
+    valor = expenses_df['Centavos'].to_numpy(dtype=np.int64)
+    pagador = expenses_df['Pagador']
+    both = pagador.eq('Ambos').to_numpy(dtype=bool, na_value=False)
+    split_p1 = expenses_df['Split Pessoa 1'].to_numpy(dtype=np.int64, na_value=0)
+    split_p2 = expenses_df['Split Pessoa 2'].to_numpy(dtype=np.int64, na_value=0)
+    share_p1 = (valor * split_p1 + 50) // 100
+    share_p2 = np.where(split_p1 + split_p2 == 100, valor - share_p1, (valor * split_p2 + 50) // 100)
+    paid_p1 = np.where(pagador.eq(person1_name).to_numpy(dtype=bool, na_value=False), valor, np.where(both, share_p1, 0))
+    paid_p2 = np.where(pagador.eq(person2_name).to_numpy(dtype=bool, na_value=False), valor, np.where(both, share_p2, 0))
+    return paid_p1, paid_p2
+
+
+def compute_settlement(expenses_df, person1_name, person2_name, share_p1=0.5):
+    """
+    Calcula quanto cada pessoa pagou, quanto deveria ter pagado (share_p1 do total para a
+    Pessoa 1, o restante para a Pessoa 2) e o saldo líquido. Saldo positivo = tem a receber.
+    Inclui 'devedor', 'credor' e 'valor' do acerto (devedor/credor None quando quites).
+    As contas são feitas em centavos; os valores devolvidos estão em reais.
+    """
+    paid_p1, paid_p2 = contributions(expenses_df, person1_name, person2_name)
+    total_p1, total_p2 = int(paid_p1.sum()), int(paid_p2.sum())
+    total = total_p1 + total_p2
+    fair_p1 = int(round(total * share_p1))
+    fair_p2 = total - fair_p1
+    net_p1, net_p2 = total_p1 - fair_p1, total_p2 - fair_p2
+    settlement = {
+        'total': total / 100,
+        'pago': {person1_name: total_p1 / 100, person2_name: total_p2 / 100},
+        'parte_justa': {person1_name: fair_p1 / 100, person2_name: fair_p2 / 100},
+        'saldo': {person1_name: net_p1 / 100, person2_name: net_p2 / 100},
+        'devedor': None, 'credor': None, 'valor': abs(net_p1) / 100,
+    }
+    if net_p1 > 0:
+        settlement['devedor'], settlement['credor'] = person2_name, person1_name
+    elif net_p1 < 0:
+        settlement['devedor'], settlement['credor'] = person1_name, person2_name
+    return settlement
+
+
+def monthly_balance(expenses_df, person1_name, person2_name, share_p1=0.5):
+    """
+    Resumo mês a mês com o que cada um pagou, o saldo do mês da Pessoa 1 e o saldo
+    acumulado (positivo = Pessoa 2 deve à Pessoa 1). Somado em centavos, exibido em reais.
+    """
+    paid_p1, paid_p2 = contributions(expenses_df, person1_name, person2_name)
+    months = pd.to_datetime(expenses_df['Data']).to_numpy().astype('datetime64[M]')
+    frame = pd.DataFrame({'Mês': months, person1_name: paid_p1, person2_name: paid_p2})
+    monthly = frame.groupby('Mês', sort=True)[[person1_name, person2_name]].sum()
+    monthly.index = monthly.index.strftime('%Y-%m')
+    monthly['Total'] = monthly[person1_name] + monthly[person2_name]
+    monthly['Saldo do Mês'] = monthly[person1_name] - (monthly['Total'] * share_p1).round().astype('int64')
+    monthly['Saldo Acumulado'] = monthly['Saldo do Mês'].cumsum()
+    return (monthly / 100).reset_index()
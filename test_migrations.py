@@ -0,0 +1,82 @@
+# test_migrations.py
+from datetime import date
+
+import pytest
+from sqlalchemy import text
+
+import db_backends
+import migrations
+
+# --- MIGRAÇÕES NO SQLITE ---
+# Cada passo precisa ser atômico: se falhar no meio, o banco volta à versão anterior e a
+# próxima chamada de migrate() aplica o passo do zero.
+
+
+class _FailAfterRebuild(db_backends.SQLiteBackend):
+    """Falha no v7 depois de recriar e renomear 'despesas' (CREATE, cópia, DROP e RENAME já feitos)."""
+
+    def reset_id_sequence(self, conn, table):
+        raise RuntimeError("falha simulada no meio do v7")
+
+
+def _insert_v6_expense(conn):
+    conn.execute(text("""
+        INSERT INTO despesas (username, descricao, valor, categoria, data, pagador, split_pessoa1, split_pessoa2)
+        VALUES ('ana', 'Padaria', 12.34, 'Supermercado', :data, 'Ambos', 50.0, 50.0)
+    """), {'data': date(2026, 9, 5)})
+
+
+def _v6_database(tmp_path, monkeypatch):
+    backend = db_backends.SQLiteBackend()
+    engine = backend.create_engine(f"sqlite:///{tmp_path / 'gastos.db'}")
+    monkeypatch.setattr(migrations, "MIGRATIONS", migrations.MIGRATIONS[:6])
+    migrations.migrate(engine, backend)
+    monkeypatch.undo()
+    with engine.begin() as conn:
+        _insert_v6_expense(conn)
+        conn.execute(text("INSERT INTO orcamentos_categoria (username, categoria, limite) VALUES ('ana', 'Supermercado', 500.1)"))
+    return backend, engine
+
+
+def _tables(conn):
+    return set(conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'")).scalars())
+
+
+def test_v7_failure_rolls_back_and_retry_applies(tmp_path, monkeypatch):
+    backend, engine = _v6_database(tmp_path, monkeypatch)
+
+    with pytest.raises(RuntimeError, match="falha simulada"):
+        migrations.migrate(engine, _FailAfterRebuild())
+    with engine.connect() as conn:
+        assert migrations.current_version(conn) == 6
+        assert not {'despesas_v7', 'orcamentos_categoria_v7'} & _tables(conn)
+        assert conn.execute(text("SELECT valor FROM despesas")).scalar() == pytest.approx(12.34)
+
+    assert migrations.migrate(engine, backend) == [7, 8]
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT valor_centavos, split_pessoa1 FROM despesas")).one() == (1234, 50)
+        assert conn.execute(text("SELECT limite_centavos FROM orcamentos_categoria")).scalar() == 50010
+        assert conn.execute(text("SELECT total_centavos, quantidade FROM resumo_mensal_categoria")).one() == (1234, 1)
+
+
+def test_v7_ignores_leftover_staging_tables(tmp_path, monkeypatch):
+    backend, engine = _v6_database(tmp_path, monkeypatch)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE despesas_v7 (id INTEGER)"))
+        conn.execute(text("CREATE TABLE orcamentos_categoria_v7 (id INTEGER)"))
+
+    assert migrations.migrate(engine, backend) == [7, 8]
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT valor_centavos FROM despesas")).scalar() == 1234
+
+
+def test_v8_numbers_existing_duplicates(tmp_path, monkeypatch):
+    backend, engine = _v6_database(tmp_path, monkeypatch)
+    with engine.begin() as conn:
+        _insert_v6_expense(conn)
+
+    migrations.migrate(engine, backend)
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT hash_importacao, ocorrencia FROM despesas ORDER BY id")).fetchall()
+    assert [r.ocorrencia for r in rows] == [1, 2]
+    assert {r.hash_importacao for r in rows} == {migrations.expense_hash(date(2026, 9, 5), 1234, " padaria ")}
@@ -0,0 +1,103 @@
+# voice_utils.py
+import hashlib
+import io
+import wave
+
+import numpy as np
+
+import cache_utils
+import openai_utils
+
+# --- REGISTRO DE GASTOS POR VOZ ---
+# O áudio gravado no app é convertido para WAV mono de 16 kHz / 16 bits (a taxa que o
+# Whisper usa internamente) antes do envio, o que reduz o upload em até 6x em relação a uma
+# gravação estéreo de 48 kHz. As transcrições ficam num cache pelo hash do áudio original,
+# então um rerun com o mesmo clipe nunca transcreve de novo.
+
+TARGET_SAMPLE_RATE = 16000
+MAX_AUDIO_SECONDS = 60
+MAX_INPUT_BYTES = 25 * 1024 * 1024  # limite de upload da API Whisper
+
+_transcripts = cache_utils.LRUCache(maxsize=256, ttl=None)
+
+
+def audio_hash(audio_bytes):
+    return hashlib.sha256(audio_bytes).hexdigest()
+
+
+def prepare_audio(audio_bytes, target_rate=TARGET_SAMPLE_RATE, max_seconds=MAX_AUDIO_SECONDS):
+    """
+    Valida e reduz um WAV: mistura os canais em mono, reamostra para target_rate e grava em
+    PCM de 16 bits. Levanta ValueError se o arquivo não for WAV ou passar dos limites.
+    """
+    if len(audio_bytes) > MAX_INPUT_BYTES:
+        raise ValueError("O áudio é grande demais.")
+    try:
+        with wave.open(io.BytesIO(audio_bytes), "rb") as wav:
+            channels, width, rate, frames = wav.getnchannels(), wav.getsampwidth(), wav.getframerate(), wav.getnframes()
+            raw = wav.readframes(frames)
+    except (wave.Error, EOFError) as e:
+        raise ValueError(f"Formato de áudio não suportado: {e}")
+    if frames / rate > max_seconds:
+        raise ValueError(f"O áudio passa de {max_seconds} segundos.")
+    if width not in (1, 2, 4):
+        raise ValueError("Profundidade de bits não suportada.")
+
+    dtype = {1: np.uint8, 2: np.int16, 4: np.int32}[width]
+    samples = np.frombuffer(raw, dtype=dtype).astype(np.float32)
+    if width == 1:
+        samples = (samples - 128.0) * 256.0
+    elif width == 4:
+        samples /= 65536.0
+    samples = samples.reshape(-1, channels).mean(axis=1)
+    if rate > target_rate:
+        # Interpolação linear: suficiente para voz e sem dependências extras.
+        target_length = int(len(samples) * target_rate / rate)
+        samples = np.interp(np.linspace(0, len(samples) - 1, target_length), np.arange(len(samples)), samples)
+        rate = target_rate
+
+    output = io.BytesIO()
+    with wave.open(output, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(np.clip(samples, -32768, 32767).astype(np.int16).tobytes())
+    return output.getvalue()
+
+
+# --- BACKENDS DE TRANSCRIÇÃO ---
+# 'openai' usa o Whisper (openai_utils.transcribe_audio). 'local' é um substituto offline
+# para testes: devolve o texto cadastrado para o hash do áudio ou um texto fixo.
+
+class LocalTranscriber:
+    """Transcritor offline: {hash do áudio preparado: texto}, com um texto padrão opcional."""
+
+    def __init__(self, transcripts=None, default_text=None):
+        self.transcripts = dict(transcripts or {})
+        self.default_text = default_text
+
+    def __call__(self, audio_bytes, username=None):
+        return self.transcripts.get(audio_hash(audio_bytes), self.default_text)
+
+
+BACKENDS = {"openai": openai_utils.transcribe_audio}
+
+
+def register_backend(name, transcribe_fn):
+    """Registra uma função (bytes do WAV, username=None) -> texto ou None como backend de transcrição."""
+    BACKENDS[name] = transcribe_fn
+
+
+def transcribe(audio_bytes, backend="openai", username=None):
+    """
+    Transcreve o áudio gravado, usando o cache pelo hash do conteúdo original.
+    Retorna o texto, ou None se o backend não conseguir transcrever.
+    """
+    key = (backend, audio_hash(audio_bytes))
+    found, text = _transcripts.get(key)
+    if found:
+        return text
+    text = BACKENDS[backend](prepare_audio(audio_bytes), username=username)
+    if text:
+        _transcripts.set(key, text)
+    return text